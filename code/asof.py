@@ -0,0 +1,276 @@
+import os
+import json
+import bisect
+import datetime
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from vintage_store import file_hash, list_vintage_files, read_vintages, store_available
+from reporting_triangles import SOURCE_DICT, prepare_data
+from week_functions import iso_week, iso_year
+from job_runner import run_jobs
+from instrumentation import count, set_rows
+from schemas import read_csv
+import config
+
+# As-of queries over all vintages of a (source, disease, tests) combination, e.g. the value reported for
+# (location, age_group, week) as known at data version V, without reading the csv files again.
+# The index only stores changes: a record (stratum, date, data version, value) is added whenever a value
+# appears, is revised or is dropped from a vintage (present=False). The value as of V is the last record
+# of the (stratum, date) with data version <= V. Stored in <data>/<source>/<disease>/asof[-tests]/ as
+#   key.npy      int64, (stratum * n_dates + date) * n_versions + version, sorted
+#   value.npy    float64 (NaN if the value was missing in the file)
+#   present.npy  True if the row is contained in the vintage
+#   index.json   axis labels (strata, dates, data versions) and the hashes of the indexed files
+# The data is the same as returned by reporting_triangles.load_data (states aggregated, dates as end of the week),
+# except that only the first row of a (stratum, date) is kept if a file contains it more than once.
+
+ARRAYS = ['key', 'value', 'present']
+
+
+def index_path(source, disease, tests=False):
+    return Path(f'{config.DATA_PATH}/{source}/{disease}/asof{"-tests" if tests else ""}/')
+
+
+def load_vintage_files(source, disease, tests=False):
+    """
+    Returns a dictionary mapping data versions ('yyyy-mm-dd') to the prepared data of all vintage files.
+    """
+    files = list_vintage_files(source, disease, tests)
+    vintages = read_vintages(source, disease, tests) if store_available(source, disease, tests) else {}
+
+    dfs = {}
+    for f in files:
+        data_version = f.name[:10]
+        if data_version in vintages:
+            df = vintages[data_version]
+        else:
+            df = read_csv(f, 'vintage')
+            count('files_read')
+        dfs[data_version] = prepare_data(df, source)
+
+    return dfs
+
+
+def change_records(df, n_versions):
+    """
+    Reduces the rows of all vintages (columns stratum, date, version, value as codes) to change records.
+    Returns (group, version, value, present) with group = stratum * n_dates + date.
+    """
+    df = df.sort_values(['group', 'version'], kind='stable', ignore_index=True)
+    group, version, value = df.group.to_numpy(), df.version.to_numpy(), df.value.to_numpy(dtype='float64')
+
+    first = np.r_[True, group[1:] != group[:-1]]
+    last = np.r_[group[1:] != group[:-1], True]
+    same = np.r_[False, (value[1:] == value[:-1]) | (np.isnan(value[1:]) & np.isnan(value[:-1]))]
+    # rows following a gap (the value was missing in the vintages in between)
+    gap = np.r_[False, version[1:] > version[:-1] + 1] & ~first
+
+    # value changed, first appearance or reappearance
+    changed = first | gap | ~same
+    # the row was dropped in the vintage after its last or before a gap
+    dropped_after = (last & (version < n_versions - 1)) | np.r_[gap[1:], False]
+
+    records = pd.concat([pd.DataFrame({'group': group[changed], 'version': version[changed],
+                                       'value': value[changed], 'present': True}),
+                         pd.DataFrame({'group': group[dropped_after], 'version': version[dropped_after] + 1,
+                                       'value': np.nan, 'present': False})])
+    records = records.sort_values(['group', 'version'], ignore_index=True)
+
+    return records
+
+
+def build_index(source, disease, tests=False):
+    """
+    Builds the as-of index from all vintage files (and the columnar vintage store if available).
+    """
+    dfs = load_vintage_files(source, disease, tests)
+    files = list_vintage_files(source, disease, tests)
+    data_versions = list(dfs.keys())
+
+    df = pd.concat([df.assign(version=i) for i, df in enumerate(dfs.values())], ignore_index=True)
+    set_rows(rows_in=len(df))
+
+    stratum_codes, strata = pd.MultiIndex.from_frame(df[['location', 'age_group']]).factorize(sort=True)
+    date_codes, dates = pd.factorize(df.date.astype(str), sort=True)
+    columns = list(df.columns.drop('version'))
+
+    df = pd.DataFrame({'group': stratum_codes.astype('int64') * len(dates) + date_codes,
+                       'version': df.version.to_numpy(),
+                       'value': df.value.astype('float64')})
+    # a file can contain a (stratum, date) more than once, keep the first row as combine_file_history does
+    df = df.drop_duplicates(subset=['group', 'version'], keep='first')
+    records = change_records(df, len(data_versions))
+
+    # values are returned as integers unless the files contained non-integer values
+    values = records.value.to_numpy()
+    integer = bool(np.all(np.isnan(values) | (values == np.round(values))))
+
+    metadata = {'location': [s[0] for s in strata],
+                'age_group': [s[1] for s in strata],
+                'date': list(dates),
+                'data_version': data_versions,
+                'columns': columns,
+                'integer': integer,
+                'files': {f.name: file_hash(f) for f in files}}
+
+    path = index_path(source, disease, tests)
+    os.makedirs(path, exist_ok=True)
+    arrays = {'key': records.group.to_numpy() * len(data_versions) + records.version.to_numpy(),
+              'value': values,
+              'present': records.present.to_numpy(dtype=bool)}
+    for name, content in arrays.items():
+        tmp_path = path / f'.{name}.npy.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, content)
+        tmp_path.replace(path / f'{name}.npy')
+    (path / '.index.json.tmp').write_text(json.dumps(metadata, indent=1))
+    (path / '.index.json.tmp').replace(path / 'index.json')
+
+    set_rows(rows_out=len(records))
+    print(f'{source}/{disease}{"-tests" if tests else ""}: {len(records)} change records for {len(data_versions)} vintages.')
+
+
+def index_up_to_date(source, disease, tests=False):
+    path = index_path(source, disease, tests) / 'index.json'
+    if not path.exists():
+        return False
+    files = json.loads(path.read_text())['files']
+    return files == {f.name: file_hash(f) for f in list_vintage_files(source, disease, tests)}
+
+
+def load_index(source, disease, tests=False, mmap_mode='r'):
+    """
+    Opens the as-of index (memory-mapped by default). The index has to be built with build_index before.
+    Returns a dictionary with the arrays and the metadata (key 'metadata').
+    """
+    path = index_path(source, disease, tests)
+    metadata = json.loads((path / 'index.json').read_text())
+    index = {name: np.load(path / f'{name}.npy', mmap_mode=mmap_mode) for name in ARRAYS}
+    index['metadata'] = metadata
+    # lookup tables for the axis labels
+    index['strata'] = {s: i for i, s in enumerate(zip(metadata['location'], metadata['age_group']))}
+    index['dates'] = np.array(metadata['date'], dtype='datetime64[D]')
+    index['date_codes'] = {d: i for i, d in enumerate(metadata['date'])}
+    index['data_versions'] = np.array(metadata['data_version'], dtype='datetime64[D]')
+    return index
+
+
+def _version_code(index, data_version):
+    # latest data version on or before the given date (-1 if there is none)
+    return np.searchsorted(index['data_versions'], np.datetime64(str(data_version), 'D'), side='right') - 1
+
+
+def _lookup(index, groups, versions):
+    """
+    Positions of the records valid for the given groups as of the given version codes (-1 if not reported).
+    """
+    n_versions = len(index['data_versions'])
+    groups, versions = np.broadcast_arrays(np.asarray(groups, dtype='int64'), np.asarray(versions, dtype='int64'))
+    positions = np.searchsorted(index['key'], groups * n_versions + versions, side='right') - 1
+
+    valid = (positions >= 0) & (versions >= 0)
+    found = np.where(valid, positions, 0)
+    valid &= (np.asarray(index['key'][found]) // n_versions == groups) & np.asarray(index['present'][found])
+    return np.where(valid, positions, -1)
+
+
+def asof_value(index, location, age_group, date, data_version):
+    """
+    Value for a stratum and week (any date of the week) as known at the data version (or the latest version before).
+    Returns None if the week was not reported at that time (NaN if it was reported as missing).
+    """
+    # scalar lookups with dictionaries and bisection, the numpy machinery of _lookup costs more than the search
+    day = datetime.date.fromisoformat(str(date)[:10])
+    week_end = str(day + datetime.timedelta(days=6 - day.weekday()))
+    stratum = index['strata'].get((location, age_group))
+    date_code = index['date_codes'].get(week_end)
+    version = bisect.bisect_right(index['metadata']['data_version'], str(data_version)[:10]) - 1
+    if stratum is None or date_code is None or version < 0:
+        return None
+
+    n_versions = len(index['data_versions'])
+    group = stratum * len(index['dates']) + date_code
+    position = int(np.searchsorted(index['key'], group * n_versions + version, side='right')) - 1
+    if position < 0 or index['key'][position] // n_versions != group or not index['present'][position]:
+        return None
+    return float(index['value'][position])
+
+
+def _to_frame(index, strata, date_codes, values, data_versions=None):
+    metadata = index['metadata']
+    dates = pd.Series(index['dates'][date_codes].astype(object))
+    df = pd.DataFrame({'date': dates,
+                       'year': iso_year(dates).to_numpy(),
+                       'week': iso_week(dates).to_numpy(),
+                       'location': np.array(metadata['location'], dtype=object)[strata],
+                       'age_group': np.array(metadata['age_group'], dtype=object)[strata]})
+    if data_versions is not None:
+        df['data_version'] = data_versions
+    df['value'] = values
+    if metadata['integer']:
+        df['value'] = df.value.astype('Int64' if np.isnan(values).any() else 'int64')
+    return df[[c for c in metadata['columns'] if c in df.columns] + (['data_version'] if data_versions is not None else [])]
+
+
+def asof_range(index, data_versions, start=None, end=None, location=None, age_group=None):
+    """
+    Values of all weeks between start and end (inclusive, default: all) as known at each of the given data versions.
+    Optionally restricted to a location and/or age group.
+    Returns a long dataframe (one row per stratum, week and data version reported at that time).
+    """
+    strata = np.array([i for (l, a), i in index['strata'].items()
+                       if location in [None, l] and age_group in [None, a]], dtype='int64')
+    date_codes = np.arange(len(index['dates']))
+    if start is not None:
+        date_codes = date_codes[index['dates'] >= np.datetime64(str(pd.Timestamp(start).date()), 'D')]
+    if end is not None:
+        date_codes = date_codes[index['dates'][date_codes] <= np.datetime64(str(pd.Timestamp(end).date()), 'D')]
+
+    data_versions = [str(pd.Timestamp(v).date()) for v in data_versions]
+    versions = np.array([_version_code(index, v) for v in data_versions], dtype='int64')
+
+    # all combinations of stratum, date and version
+    groups = (strata[:, None] * len(index['dates']) + date_codes[None, :]).ravel()
+    positions = _lookup(index, groups[:, None], versions[None, :]).ravel()
+    found = positions != -1
+
+    group_codes = np.repeat(groups, len(versions))[found]
+    values = np.asarray(index['value'][positions[found]])
+    df = _to_frame(index, group_codes // len(index['dates']), group_codes % len(index['dates']), values,
+                   np.tile(np.array(data_versions, dtype=object), len(groups))[found])
+
+    return df.sort_values(['location', 'age_group', 'date', 'data_version'], ignore_index=True)
+
+
+def asof_vintage(index, data_version):
+    """
+    Reconstructs the data as known at the data version, equivalent to load_data for an existing vintage
+    without repeated rows of a (location, age_group, date), of which the first is kept
+    (columns date, year, week, location, age_group, value, sorted by location, age group and date).
+    """
+    n_versions = len(index['data_versions'])
+    groups = np.unique(np.asarray(index['key']) // n_versions)
+    positions = _lookup(index, groups, _version_code(index, data_version))
+    found = positions != -1
+
+    groups, values = groups[found], np.asarray(index['value'][positions[found]])
+    df = _to_frame(index, groups // len(index['dates']), groups % len(index['dates']), values)
+
+    return df.sort_values(['location', 'age_group', 'date'], ignore_index=True)
+
+
+def main():
+    jobs = []
+    for source in SOURCE_DICT.keys():
+        for disease in SOURCE_DICT[source]:
+            jobs.append((f'{source}/{disease}', (source, disease), {}))
+            if source in ['NRZ', 'CVN']:
+                jobs.append((f'{source}/{disease}-tests', (source, disease), {'tests': True}))
+
+    return run_jobs(build_index, jobs)
+
+
+if __name__ == '__main__':
+    if len(main()) > 0:
+        raise SystemExit(1)
@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from io import StringIO
+from pathlib import Path
+from epiweeks import Week
+from week_functions import iso_week, iso_year
+import config
+
+from reporting_triangles import compute_reporting_triangle, data_path, make_template
+from get_latest_data import combine_file_history, compute_latest_data
+from preprocess_reporting_triangles import preprocess_reporting_triangle
+from compute_target import compute_target
+
+# Benchmark of the triangle pipeline on synthetic vintages.
+# The vintages are written to a temporary directory with the same layout as ../data (set as config.DATA_PATH),
+# the pipeline functions are run from its 'code' directory. Example:
+#   python benchmark.py --vintages 100 1000 --source CVN --disease influenza --tests --output benchmark.json
+# Sources with a start date in list_all_files (NRZ, Survstat rsv) only use the vintages after that date.
+
+# raw state codes, Survstat and AGI files are aggregated with STATE_DICT when the triangles are computed
+RAW_STATES = ['DE-BB', 'DE-BE', 'DE-BW', 'DE-BY', 'DE-HB', 'DE-HE', 'DE-HH', 'DE-MV',
+              'DE-NI', 'DE-NW', 'DE-RP', 'DE-SH', 'DE-SL', 'DE-SN', 'DE-ST', 'DE-TH']
+
+
+def synthetic_strata(source, disease):
+    """
+    Strata (location, age_group) of the synthetic files, taken from the template of the triangle.
+    """
+    df = make_template(source, disease, [Week(2024, 1, system='iso')])[['location', 'age_group']]
+    if source in ['Survstat', 'AGI', 'AGI_abs']:
+        df_states = pd.DataFrame({'location': RAW_STATES, 'age_group': '00+'})
+        df = pd.concat([df[df.location == 'DE'], df_states], ignore_index=True)
+    return df
+
+
+def make_vintages(source, disease, n_vintages, tests=False, window=30, negative_revisions=0.05, seed=0,
+                  end=Week(2025, 20, system='iso')):
+    """
+    Writes n_vintages weekly data versions (ending with week 'end') to <config.DATA_PATH>/<source>/<disease>/.
+    Every vintage covers the last 'window' weeks. The values of a week grow with the delay towards a final value
+    (geometric reporting delays), a share of the reports is revised downwards (negative corrections).
+    Returns the paths of the written files.
+    """
+    rng = np.random.default_rng(seed)
+    strata = synthetic_strata(source, disease)
+
+    # all weeks covered by the vintages, vintage i covers the weeks i, ..., i + window - 1
+    weeks = pd.date_range(end=pd.Timestamp(end.enddate()), periods=n_vintages + window - 1, freq='W-SUN')
+    dates = weeks.strftime('%Y-%m-%d').to_numpy()
+    years, week_numbers = iso_year(weeks).to_numpy(), iso_week(weeks).to_numpy()
+
+    # final values per week and stratum, test counts are larger
+    final = rng.poisson(200 if tests else 50, size=(len(weeks), len(strata))).astype(float)
+    completeness = 1 - 0.5 ** (np.arange(window)[::-1] + 1)
+
+    files = []
+    for i in range(n_vintages):
+        rows = slice(i, i + window)
+        values = final[rows] * completeness[:, None]
+        revised = rng.random(values.shape) < negative_revisions
+        values = np.floor(values * np.where(revised, 0.9, 1))
+
+        df = pd.DataFrame({'date': np.repeat(dates[rows], len(strata)),
+                           'year': np.repeat(years[rows], len(strata)),
+                           'week': np.repeat(week_numbers[rows], len(strata)),
+                           'location': np.tile(strata.location, window),
+                           'age_group': np.tile(strata.age_group, window),
+                           'value': values.ravel().astype(int)})
+
+        path = Path(data_path(source, disease, dates[i + window - 1], tests))
+        os.makedirs(path.parent, exist_ok=True)
+        df.to_csv(path, index=False)
+        files.append(path)
+
+    if source == 'Survstat' and disease != 'covid19':
+        # compute_latest_data adds the history before the weekly files, an empty one is sufficient
+        pd.DataFrame(columns=['date', 'year', 'week', 'location', 'age_group', 'value']).to_csv(f'{config.DATA_PATH}/Survstat/history-survstat-{disease}.csv', index=False)
+
+    return files
+
+
+def measure(func, memory=True):
+    """
+    Runs func and returns (result, seconds, peak memory in MB).
+    The peak memory is measured with tracemalloc in a second run, so it does not affect the timing.
+    """
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    return result, seconds, peak
+
+
+def run_benchmark(source, disease, n_vintages, tests=False, window=30, max_delay=10, memory=True, seed=0):
+    """
+    Runs all stages for n_vintages synthetic vintages (the current directory has to be the 'code' directory
+    of a data root). Returns a list of result records.
+    """
+    files = make_vintages(source, disease, n_vintages, tests, window, seed=seed)
+    dfs = [pd.read_csv(f) for f in files]
+    name = {'source': source, 'disease': disease, 'tests': tests, 'vintages': n_vintages}
+
+    stages = [('combine_file_history', lambda: combine_file_history(dfs), sum(len(df) for df in dfs)),
+              ('compute_latest_data', lambda: compute_latest_data(source, disease, tests), None),
+              ('compute_reporting_triangle', lambda: compute_reporting_triangle(source, disease, tests, max_delay,
+                                                                                export=False), None)]
+
+    results = []
+    outputs = {}
+    for stage, func, rows_in in stages:
+        df, seconds, peak = measure(func, memory)
+        outputs[stage] = df
+        results.append({**name, 'stage': stage, 'seconds': seconds, 'peak_memory_mb': peak,
+                        'rows_in': rows_in, 'rows_out': None if df is None else len(df)})
+
+    # the following stages read the triangle from csv
+    triangle = pd.read_csv(StringIO(outputs['compute_reporting_triangle'].to_csv(index=False)))
+    for stage, func in [('preprocess_reporting_triangle',
+                         lambda: preprocess_reporting_triangle(triangle.loc[:, :'value_4w'].copy())),
+                        ('compute_target', lambda: compute_target(triangle.copy(), max_delay=4))]:
+        df, seconds, peak = measure(func, memory)
+        results.append({**name, 'stage': stage, 'seconds': seconds, 'peak_memory_mb': peak,
+                        'rows_in': len(triangle), 'rows_out': len(df)})
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the triangle pipeline on synthetic vintages.')
+    parser.add_argument('--vintages', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--source', default='Survstat')
+    parser.add_argument('--disease', default='covid19')
+    parser.add_argument('--tests', action='store_true', help='also benchmark the tests variant (NRZ, CVN)')
+    parser.add_argument('--window', type=int, default=30, help='number of weeks per vintage')
+    parser.add_argument('--max-delay', type=int, default=10)
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    variants = [False, True] if args.tests else [False]
+
+    results = []
+    for n_vintages in args.vintages:
+        for tests in variants:
+            # every run gets a fresh data root
+            root = Path(tempfile.mkdtemp(prefix='respinow-benchmark-'))
+            os.makedirs(root / 'code')
+            config.DATA_PATH = root / 'data'
+            cwd = os.getcwd()
+            os.chdir(root / 'code')
+            try:
+                for r in run_benchmark(args.source, args.disease, n_vintages, tests, args.window, args.max_delay,
+                                       not args.no_memory, args.seed):
+                    print(f"{r['vintages']:>6} {'tests' if r['tests'] else '':5} {r['stage']:<30} "
+                          f"{r['seconds']:9.3f} s  {r['peak_memory_mb'] or float('nan'):9.1f} MB")
+                    results.append(r)
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(root)
+
+    report = {'config': vars(args),
+              'environment': {'python': sys.version.split()[0],
+                              'pandas': pd.__version__,
+                              'numpy': np.__version__,
+                              'platform': platform.platform(),
+                              'cpus': os.cpu_count()},
+              'results': results}
+    output.write_text(json.dumps(report, indent=1))
+    print("Report:", output)
@@ -1,5 +1,7 @@
-import pandas as pd
-from pathlib import Path
+from job_runner import run_jobs, write_csv
+from instrumentation import count, set_rows
+from schemas import read_csv
+import config
 
 def compute_target(df, max_delay=4):
     df = df.loc[:, :f'value_{max_delay}w']
@@ -7,15 +9,31 @@ def compute_target(df, max_delay=4):
     df = df[[c for c in df.columns if 'value_' not in c]]
     return df
 
+def target_path(f, max_delay=4):
+    # targets for other maximum delays than 4 weeks get the suffix -max<d>w
+    name = f.name.split('-', 1)[-1]
+    if max_delay != 4:
+        name = name.replace('.csv', f'-max{max_delay}w.csv')
+    return f.with_name('target-' + name)
 
-path = Path('../data/')
-files = [f for f in path.rglob('reporting_triangle*.csv') if 'preprocessed' not in f.name]
-
-for f in files:
+def process_file(f):
     print("Processing:", f)
-    df = pd.read_csv(f)
+    df = read_csv(f, 'triangle')
+    count('files_read')
+    set_rows(rows_in=len(df))
     df = compute_target(df, max_delay=4)
-    target_path = f.with_name('target-' + f.name.split('-', 1)[-1])
-    df.to_csv(target_path, index=False)
-    print("Done:", target_path)
-    
\ No newline at end of file
+    set_rows(rows_out=len(df))
+    write_csv(df, target_path(f), kind='target')
+    print("Done:", target_path(f))
+
+
+def main():
+    path = config.DATA_PATH
+    files = [f for f in path.rglob('reporting_triangle*.csv') if 'preprocessed' not in f.name]
+
+    return run_jobs(process_file, [(str(f), (f,), {}) for f in files])
+
+
+if __name__ == '__main__':
+    if len(main()) > 0:
+        raise SystemExit(1)
@@ -0,0 +1,7 @@
+import os
+from pathlib import Path
+
+# Location of the data directory. By default, all scripts are run from ./code and use ../data.
+# It can be set with the environment variable RESPINOW_DATA or by assigning config.DATA_PATH
+# (paths are resolved when the functions are called, not when the modules are imported).
+DATA_PATH = Path(os.environ.get('RESPINOW_DATA', '../data'))
@@ -0,0 +1,230 @@
+import os
+import sys
+import gzip
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from io import StringIO
+from pathlib import Path
+from vintage_store import file_hash, list_vintage_files
+from reporting_triangles import SOURCE_DICT
+from instrumentation import count
+import config
+
+# Delta-encoded storage of the vintage csv files of a (source, disease, tests) combination.
+# Consecutive vintages repeat almost all rows, so every vintage is stored as the lines added to its predecessor
+# plus references to the ranges of lines copied from it. Objects are content-addressed (file name = hash of the
+# content) and immutable, e.g. ../data/NRZ/influenza/deltas/objects/<md5>.json.gz with
+#   {"base": <object of the predecessor or null>, "ops": [[start, length] (copied lines) or "added lines", ...]}
+# Every KEYFRAME_INTERVAL vintages a full copy is stored, so reconstructing a vintage never applies more deltas.
+# The manifest (_manifest.csv) maps the data versions to their files, objects and the hashes of the csv files.
+# The csv files are reconstructed byte by byte and can be exported back to the per-file layout (export_csv),
+# so the csv files of stored vintages can be removed. Usage: python delta_store.py [update | export [root]]
+
+KEYFRAME_INTERVAL = 52
+MANIFEST_COLUMNS = ['data_version', 'filename', 'md5', 'object', 'depth']
+
+
+def delta_path(source, disease, tests=False):
+    return Path(f'{config.DATA_PATH}/{source}/{disease}/deltas{"-tests" if tests else ""}/')
+
+
+def load_manifest(source, disease, tests=False):
+    path = delta_path(source, disease, tests) / '_manifest.csv'
+    if not path.exists():
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return pd.read_csv(path, dtype={'data_version': str, 'filename': str, 'md5': str, 'object': str})
+
+
+def write_manifest(df, source, disease, tests=False):
+    path = delta_path(source, disease, tests) / '_manifest.csv'
+    df.to_csv(path.with_suffix('.tmp'), index=False)
+    os.replace(path.with_suffix('.tmp'), path)
+
+
+def encode_delta(lines, base_lines):
+    """
+    Encodes lines as operations on base_lines: [start, length] copies a range of base lines, a string adds lines.
+    """
+    if base_lines is None or len(lines) == 0:
+        return [''.join(lines)] if len(lines) > 0 else []
+
+    # position of every line in the base (first occurrence), -1 for new lines
+    base = pd.Index(base_lines)
+    positions = pd.Index(base[~base.duplicated()]).get_indexer(lines)
+    positions = np.where(positions >= 0, np.flatnonzero(~base.duplicated())[positions], -1)
+
+    # runs of consecutive base lines are copied, all other lines are added
+    new_op = np.r_[True, (positions[1:] != positions[:-1] + 1) | (positions[1:] == -1) | (positions[:-1] == -1)]
+    # consecutive added lines are merged into one operation
+    new_op &= ~np.r_[False, (positions[1:] == -1) & (positions[:-1] == -1)]
+    starts = np.flatnonzero(new_op)
+    ends = np.r_[starts[1:], len(lines)]
+
+    ops = []
+    for start, end in zip(starts, ends):
+        if positions[start] == -1:
+            ops.append(''.join(lines[start:end]))
+        else:
+            ops.append([int(positions[start]), int(end - start)])
+    return ops
+
+
+def apply_delta(ops, base_lines):
+    lines = []
+    for op in ops:
+        if isinstance(op, str):
+            lines += op.splitlines(keepends=True)
+        else:
+            lines += base_lines[op[0]:op[0] + op[1]]
+    return lines
+
+
+def write_object(content, source, disease, tests=False):
+    """
+    Stores an object under the hash of its content (existing objects are not written again). Returns the hash.
+    """
+    data = json.dumps(content, separators=(',', ':')).encode('utf-8')
+    key = hashlib.md5(data).hexdigest()
+    path = delta_path(source, disease, tests) / 'objects' / f'{key}.json.gz'
+    if not path.exists():
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        # mtime=0 so that the same content always gives the same file
+        tmp_path.write_bytes(gzip.compress(data, mtime=0))
+        os.replace(tmp_path, path)
+    return key
+
+
+def read_object(key, source, disease, tests=False):
+    path = delta_path(source, disease, tests) / 'objects' / f'{key}.json.gz'
+    count('files_read')
+    return json.loads(gzip.decompress(path.read_bytes()))
+
+
+def reconstruct_lines(key, source, disease, tests=False, cache=None):
+    """
+    Lines of the vintage stored in object 'key' (following the chain of bases back to the last full copy).
+    With a cache (dictionary of object -> lines), already reconstructed vintages are reused.
+    """
+    cache = {} if cache is None else cache
+    chain = []
+    while key is not None and key not in cache:
+        content = read_object(key, source, disease, tests)
+        chain.append((key, content))
+        key = content['base']
+
+    lines = cache.get(key)
+    for key, content in chain[::-1]:
+        lines = apply_delta(content['ops'], lines)
+        cache[key] = lines
+    return lines
+
+
+def update_delta_store(source, disease, tests=False):
+    """
+    Adds all csv vintages that are new or have changed since the last update, each as delta to its predecessor.
+    Returns the number of added vintages.
+    """
+    manifest = load_manifest(source, disease, tests)
+    # stored vintages (also those whose csv file was removed), the predecessor of a file is the one with the
+    # largest file name before it
+    stored = {row.filename: (row.md5, row.object, int(row.depth)) for row in manifest.itertuples()}
+
+    entries = []
+    cache = {}
+    for f in list_vintage_files(source, disease, tests):
+        md5 = file_hash(f)
+        if f.name in stored and stored[f.name][0] == md5:
+            continue
+
+        lines = f.read_bytes().decode('utf-8').splitlines(keepends=True)
+        count('files_read')
+        previous = [name for name in stored if name < f.name]
+        previous = stored[max(previous)] if len(previous) > 0 else None
+        if previous is None or previous[2] + 1 >= KEYFRAME_INTERVAL:
+            content, depth = {'base': None, 'ops': encode_delta(lines, None)}, 0
+        else:
+            base_lines = reconstruct_lines(previous[1], source, disease, tests, cache)
+            content, depth = {'base': previous[1], 'ops': encode_delta(lines, base_lines)}, previous[2] + 1
+
+        key = write_object(content, source, disease, tests)
+        cache = {key: lines} # files are processed in order, so the next file usually is a delta to this one
+        stored[f.name] = (md5, key, depth)
+        entries.append({'data_version': f.name[:10], 'filename': f.name, 'md5': md5, 'object': key, 'depth': depth})
+
+    if len(entries) > 0:
+        manifest = pd.concat([manifest, pd.DataFrame(entries)])
+        manifest = manifest.drop_duplicates(subset='filename', keep='last')
+        manifest = manifest.sort_values('filename', ignore_index=True)
+        write_manifest(manifest, source, disease, tests)
+
+    return len(entries)
+
+
+def read_delta_vintage(source, disease, data_version, tests=False):
+    """
+    Reads a vintage from the delta store, same as pd.read_csv of the original file.
+    """
+    manifest = load_manifest(source, disease, tests)
+    row = manifest[manifest.data_version == str(data_version)].iloc[-1]
+    text = ''.join(reconstruct_lines(row.object, source, disease, tests))
+    return pd.read_csv(StringIO(text))
+
+
+def iter_history(source, disease, tests=False):
+    """
+    Yields (filename, content) of all stored vintages in chronological order.
+    Every object is read and applied only once.
+    """
+    cache = {}
+    for row in load_manifest(source, disease, tests).itertuples():
+        lines = reconstruct_lines(row.object, source, disease, tests, cache)
+        # keep the last vintages only (bases of the following deltas)
+        cache = {k: v for k, v in list(cache.items())[-2:]}
+        yield row.filename, ''.join(lines)
+
+
+def export_csv(source, disease, tests=False, root=None):
+    """
+    Writes all stored vintages back to the per-file csv layout (<root>/<source>/<disease>/<filename>),
+    the files are identical to the original ones. Returns the number of written files.
+    """
+    path = Path(root or config.DATA_PATH) / source / disease
+    os.makedirs(path, exist_ok=True)
+    n = 0
+    for filename, text in iter_history(source, disease, tests):
+        (path / filename).write_bytes(text.encode('utf-8'))
+        n += 1
+    return n
+
+
+def store_size(source, disease, tests=False):
+    """
+    Sizes in bytes of the csv files and of the delta store.
+    """
+    csv_size = sum(f.stat().st_size for f in list_vintage_files(source, disease, tests))
+    delta_size = sum(f.stat().st_size for f in delta_path(source, disease, tests).rglob('*') if f.is_file())
+    return csv_size, delta_size
+
+
+def main(command='update', root=None):
+    """
+    update: adds new or changed csv files of all sources to the delta stores.
+    export: writes the csv files of all delta stores (to the data directory or another root).
+    """
+    for source in SOURCE_DICT.keys():
+        for disease in SOURCE_DICT[source]:
+            for tests in ([False, True] if source in ['NRZ', 'CVN'] else [False]):
+                name = f'{source}/{disease}{"-tests" if tests else ""}'
+                if command == 'update':
+                    n = update_delta_store(source, disease, tests)
+                    csv_size, delta_size = store_size(source, disease, tests)
+                    print(f'{name}: {n} new vintages, {csv_size / 2**20:.1f} MB csv, {delta_size / 2**20:.2f} MB deltas')
+                elif command == 'export':
+                    print(f'{name}: {export_csv(source, disease, tests, root)} files written')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
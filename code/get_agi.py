@@ -1,42 +1,13 @@
 import os
-import re
-import requests
 import pandas as pd
 from pathlib import Path
 from epiweeks import Week
-
-def get_all_date_tags(owner, repo):
-    # Define the GitHub API URL for tags
-    tags_url = f"https://api.github.com/repos/{owner}/{repo}/tags"
-    
-    # Send a GET request to retrieve the list of tags
-    response = requests.get(tags_url, params={'per_page': 200})
-    
-    if response.status_code == 200:
-        # Parse the JSON response to get the list of tags
-        tags_data = response.json()
-        
-        # Filter tags that match the "yyyy-mm-dd" format
-        date_tags = [tag["name"] for tag in tags_data if re.match(r'\d{4}-\d{2}-\d{2}', tag["name"])]
-        
-        return date_tags
-    else:
-        # Handle errors, e.g., repository not found or authentication issues
-        print(f"Failed to retrieve tags. Status code: {response.status_code}")
-        return []
-
-def load_file_from_tag(owner, repo, filepath, tag):
-    # Get the commit sha associated with the given tag
-    tag_url = f"https://api.github.com/repos/{owner}/{repo}/git/refs/tags/{tag}"
-    tag_response = requests.get(tag_url)
-    tag_data = tag_response.json()
-    sha = tag_data["object"]["sha"]
-
-    # Load the corresponding data in TSV format
-    raw_data_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{sha}/{filepath}"
-    data = pd.read_csv(raw_data_url, sep='\t')
-    
-    return data
+from week_functions import iso_enddate
+from vintage_store import update_store
+from github_functions import get_all_date_tags, get_new_tags, load_file_from_tag, update_tag_manifest
+from population import incidence_to_counts, population_dict
+from instrumentation import set_rows, stage, write_report
+import config
 
 def previous_sunday(date):
     return str((Week.fromdate(pd.to_datetime(date), system='iso') - 1).enddate())
@@ -74,18 +45,14 @@ def preprocess_ARE(df):
     
     df.age_group = df.age_group.replace(AGE_GROUPS)
 
-    df.date = df.date.apply(lambda x: Week(int(x[:4]), int(x[6:]), system="iso"))
-    df['week'] = df.date.apply(lambda x: x.week)
-    df['year'] = df.date.apply(lambda x: x.year)
-    df.date = df.date.apply(lambda x: x.enddate())
+    df['year'] = df.date.str[:4].astype(int)
+    df['week'] = df.date.str[6:].astype(int)
+    df.date = iso_enddate(df.year, df.week)
 
     # convert from incidence (per 100,000) to absolute counts
-    population = pd.read_csv('https://raw.githubusercontent.com/KITmetricslab/RESPINOW-Hub/main/respinow_viz/plot_data/other/population_sizes.csv', 
-                        usecols=['location', 'age_group', 'population'])
-    population = population[population.location == 'DE']
-    pop_dict = dict(zip(population.age_group, population.population))
+    pop_dict = population_dict('DE')
     pop_dict['60+'] = pop_dict['60-79'] + pop_dict['80+']
-    df.value = df.fillna(0).apply(lambda x: int(x['value']*pop_dict[x['age_group']]/100000), axis=1)
+    df.value = incidence_to_counts(df.value.fillna(0), df.age_group, pop_dict)
     
     return df[['date', 'year', 'week', 'location', 'age_group', 'value']]
 
@@ -94,16 +61,31 @@ OWNER = "robert-koch-institut"
 REPO = "ARE-Konsultationsinzidenz"
 FILEPATH = "ARE-Konsultationsinzidenz.tsv"
 
-tags = get_all_date_tags(OWNER, REPO)
-print("List of tags:", tags)
+def main():
+    tag_manifest = f'{config.DATA_PATH}/AGI_abs/tag_manifest.csv'
+    tags = get_all_date_tags(OWNER, REPO, with_sha=True)
+    print("List of tags:", list(tags))
+
+    path = Path(f'{config.DATA_PATH}/AGI_abs/are/')
+    os.makedirs(path, exist_ok=True)
+    # only tags that were not ingested before (or were moved to another commit) are downloaded
+    new_tags = get_new_tags(tags, tag_manifest,
+                            is_ingested=lambda date: (path / f'{previous_sunday(date)}-agi-are.csv').exists())
+
+    for date, sha in new_tags.items():
+        print(date)
+        with stage('ingest_tag', source='AGI_abs', disease='are', data_version=previous_sunday(date)):
+            df = load_file_from_tag(OWNER, REPO, FILEPATH, date, sha)
+            df = preprocess_ARE(df)
+            set_rows(rows_out=len(df))
+            df.to_csv(f'{config.DATA_PATH}/AGI_abs/are/{previous_sunday(date)}-agi-are.csv', index=False)
+            update_tag_manifest(tag_manifest, date, sha)
+
+    with stage('update_store', source='AGI_abs', disease='are'):
+        update_store('AGI_abs', 'are')
+
+    write_report('get_agi')
 
-path = Path('../data/AGI_abs/are/')
-os.makedirs(path, exist_ok=True)
-dates_processed = sorted([file.name[:10] for file in path.glob('*.csv')])
-new_dates = [date for date in tags if previous_sunday(date) not in dates_processed]
 
-for date in new_dates:
-    print(date)
-    df = load_file_from_tag(OWNER, REPO, FILEPATH, date)
-    df = preprocess_ARE(df)
-    df.to_csv(f'../data/AGI_abs/are/{previous_sunday(date)}-agi-are.csv', index=False)
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,95 @@
 import os
 import pandas as pd
 from pathlib import Path
-import requests
-from pyzipper import AESZipFile
+import http_client
 from io import BytesIO
 from epiweeks import Week
+from week_functions import iso_week, iso_year
+from vintage_store import update_store
+from instrumentation import count, stage, write_report
+import config
 
-USERNAME = os.environ['CVN_USER']
-PASSWORD = os.environ['CVN_PASSWORD']
-URL = os.environ['CVN_URL']
+def get_credentials():
+    # read when the data is downloaded, so the module can be imported without credentials
+    return os.environ['CVN_URL'], os.environ['CVN_USER'], os.environ['CVN_PASSWORD']
 
-def process_files(files):
-    cols = ['respId', 'patId', 'dt', 'date', 'infasaisonpos', 'rsvpos', 'bakstrepos']
+def cache_path():
+    # decoded daily extracts and the deduplicated records are cached locally (not part of the repository),
+    # so every archive is only downloaded and decrypted once
+    return Path(os.environ.get('CVN_CACHE', '../.cache/cvn/'))
 
-    dfs = []
-    for file in files:
-        r = requests.get(URL + file, auth=(USERNAME, PASSWORD))
-        
-        if r.status_code == 200:
-            zipdata = AESZipFile(BytesIO(r.content)) # unzip without writing to file
-            temp = pd.read_csv(zipdata.open('respAll_filtered.csv', pwd=bytes(PASSWORD,'utf-8')), 
-                               usecols=lambda x: x in cols, encoding='unicode_escape')
-#             if len(temp.columns) != len(cols):
-#                 print(f"Missing columns in {file}: {[c for c in cols if c not in temp.columns]}.")
-            dfs.append(temp)     
-        else:
-            print(f"{file} does not exist.")
+COLS = ['respId', 'patId', 'dt', 'date', 'infasaisonpos', 'rsvpos', 'bakstrepos']
+# identifiers are read as text so that cached and freshly downloaded records match exactly
+DTYPES = {'respId': str, 'patId': str, 'date': str}
+
+def write_cache(df, path):
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    df.to_csv(tmp_path, index=False, compression='gzip')
+    os.replace(tmp_path, path)
+
+def load_extract(file):
+    """
+    Loads the relevant columns of a daily archive, from the local cache if it was downloaded before.
+    Returns None if the archive does not exist.
+    """
+    path = cache_path() / 'extracts' / file.replace('.zip', '.csv.gz')
+    if path.exists():
+        count('cache_hits')
+        return pd.read_csv(path, dtype=DTYPES)
+
+    url, username, password = get_credentials()
+    r = http_client.get(url + file, auth=(username, password))
+    
+    if r.status_code == 200:
+        from pyzipper import AESZipFile
+        zipdata = AESZipFile(BytesIO(r.content)) # unzip without writing to file
+        temp = pd.read_csv(zipdata.open('respAll_filtered.csv', pwd=bytes(password,'utf-8')), 
+                           usecols=lambda x: x in COLS, dtype=DTYPES, encoding='unicode_escape')
+#         if len(temp.columns) != len(COLS):
+#             print(f"Missing columns in {file}: {[c for c in COLS if c not in temp.columns]}.")
+        write_cache(temp, path)
+        return temp
+    else:
+        print(f"{file} does not exist.")
+        return None
+
+def update_records(files):
+    """
+    Returns the deduplicated records (last entry per respId, patId and date) of all files.
+    The result is persisted together with the list of included files (only those that could be loaded).
+    If the files extend a previously persisted list, only the additional files are loaded and merged into
+    the persisted records.
+    """
+    state_path = cache_path() / 'records.csv.gz'
+    state_files_path = cache_path() / 'records_files.txt'
+
+    included = state_files_path.read_text().split() if state_files_path.exists() else []
+    if state_path.exists() and len(included) > 0 and files[:len(included)] == included:
+        dfs = [pd.read_csv(state_path, dtype=DTYPES)]
+        new_files = files[len(included):]
+    else:
+        dfs = []
+        new_files = files
+
+    extracts = {file: load_extract(file) for file in new_files}
+    dfs += list(extracts.values())
     df = pd.concat(dfs)        
     
     df = df.dropna() # drop data from 2023-04-05, add again afterwards?
     df = df.drop_duplicates(['respId', 'patId', 'date'], keep='last')
 
+    write_cache(df, state_path)
+    # archives that could not be loaded are not recorded, so the records are built again (and the archives
+    # requested again) on the next run
+    loaded = files[:len(files) - len(new_files)] + [file for file in new_files if extracts[file] is not None]
+    state_files_path.write_text('\n'.join(loaded) + '\n')
+
+    return df
+
+def process_files(files):
+    df = update_records(files)
+
     df = df.melt(id_vars=['date'], value_vars=['infasaisonpos', 'rsvpos', 'bakstrepos'], var_name = 'disease')
 
     df.disease = df.disease.replace({'bakstrepos': 'pneumococcal', 
@@ -53,7 +112,7 @@ def process_files(files):
 def export_cvn(df, date, tests=False):
     for disease in df.disease.unique():
         # daily resolution
-        path = f'../data/CVN/daily_resolution/{disease}/'
+        path = f'{config.DATA_PATH}/CVN/daily_resolution/{disease}/'
         os.makedirs(path, exist_ok=True)
         filename = f'{date}-cvn-{disease}{"-tests" if tests else ""}.csv'
         print(filename)
@@ -65,7 +124,7 @@ def export_cvn(df, date, tests=False):
         temp.to_csv(path + filename, index=False)
 
         # 7-day incidence
-        path = f'../data/CVN/{disease}/'
+        path = f'{config.DATA_PATH}/CVN/{disease}/'
         os.makedirs(path, exist_ok=True)  
         data_version = Week.fromdate(pd.to_datetime(date), system='iso').enddate()
         filename = f'{data_version}-cvn-{disease}{"-tests" if tests else ""}.csv'
@@ -73,33 +132,46 @@ def export_cvn(df, date, tests=False):
 
         temp.date = pd.to_datetime(temp.date)
         temp = temp.groupby([pd.Grouper(key='date', freq='1W'), 'location', 'age_group']).sum().reset_index()
-        temp['week'] = temp.date.apply(lambda x: Week.fromdate(x, system='iso').week)
-        temp['year'] = temp.date.apply(lambda x: Week.fromdate(x, system='iso').year)
+        temp['week'] = iso_week(temp.date)
+        temp['year'] = iso_year(temp.date)
         temp = temp[['date', 'year', 'week', 'location', 'age_group', 'value']]
         temp.to_csv(path + filename, index=False)
 
 
-path = Path('../data/CVN/daily_resolution/influenza/')
-dates_processed = sorted([file.name[:10] for file in path.glob('*.csv')])
-if len(dates_processed) == 0: dates_processed = ['2022-09-20']
+def main():
+    url, username, password = get_credentials()
+    path = Path(f'{config.DATA_PATH}/CVN/daily_resolution/influenza/')
+    dates_processed = sorted([file.name[:10] for file in path.glob('*.csv')])
+    if len(dates_processed) == 0: dates_processed = ['2022-09-20']
 
-possible_dates = pd.date_range(pd.to_datetime(dates_processed[-1]), pd.Timestamp.today(), 
-                               inclusive='right').strftime("%Y-%m-%d").to_list()
+    possible_dates = pd.date_range(pd.to_datetime(dates_processed[-1]), pd.Timestamp.today(),
+                                   inclusive='right').strftime("%Y-%m-%d").to_list()
 
-new_dates = []
-for date in possible_dates:
-    r = requests.head(URL + f'filtered_{date}.zip', auth=(USERNAME, PASSWORD))
-    if r.status_code == 200:
-        new_dates.append(date)
-        
-if (len(new_dates) == 0):
-    print("Repository already up to date!")
-else:
-    for date in new_dates:
-        print(date)
-        dates_processed.append(date)
-        files = [f'filtered_{date}.zip' for date in dates_processed]
-        df = process_files(files)
-        export_cvn(df, date, tests=False)
-        export_cvn(df, date, tests=True)
-            
+    new_dates = []
+    for date in possible_dates:
+        r = http_client.head(url + f'filtered_{date}.zip', auth=(username, password))
+        if r.status_code == 200:
+            new_dates.append(date)
+
+    if (len(new_dates) == 0):
+        print("Repository already up to date!")
+    else:
+        for date in new_dates:
+            print(date)
+            dates_processed.append(date)
+            files = [f'filtered_{date}.zip' for date in dates_processed]
+            with stage('ingest_date', source='CVN', data_version=date):
+                df = process_files(files)
+                export_cvn(df, date, tests=False)
+                export_cvn(df, date, tests=True)
+
+        for disease in ['influenza', 'rsv', 'pneumococcal']:
+            with stage('update_store', source='CVN', disease=disease):
+                update_store('CVN', disease)
+                update_store('CVN', disease, tests=True)
+
+    write_report('get_cvn')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
+import os
 import pandas as pd
-from pathlib import Path
+from vintage_store import file_hash, list_vintage_files, load_included, read_vintages, save_included, store_available
+from job_runner import run_jobs, write_csv
+from instrumentation import count, set_rows
+from schemas import read_csv, replace_values
+import config
 
 SOURCE_DICT = {
     'SARI' : ['sari', 'sari_covid19', 'sari_influenza', 'sari_rsv'],
@@ -23,42 +28,93 @@ STATE_DICT = {
 }
 
 def combine_file_history(files):
-    files = sorted(files)
-    df = pd.read_csv(files[0])
-    
-    for f in files[1:]:
-        df_new = pd.read_csv(f)
-        df = pd.concat([df_new, df]).drop_duplicates(subset=['date', 'week', 'location', 'age_group'])
+    """
+    Combines all files (paths or already loaded dataframes, in chronological order), keeping the latest value per entry.
+    """
+    dfs = [f if isinstance(f, pd.DataFrame) else read_csv(f, 'vintage') for f in files]
+    count('files_read', sum(not isinstance(f, pd.DataFrame) for f in files))
+    set_rows(rows_in=sum(len(df) for df in dfs))
+
+    # with the newest file first, drop_duplicates keeps the latest value per entry in a single pass
+    df = pd.concat(dfs[::-1]).drop_duplicates(subset=['date', 'week', 'location', 'age_group'])
         
     return df
 
-def compute_latest_data(source, disease, tests=False):
-    path = Path(f'../data/{source}/{disease}/')
-    files = [f for f in path.glob('*.csv') if ('test' in f.name.lower()) == tests]
+def load_file_history(source, disease, tests=False, names=None):
+    """
+    Loads all files (or only those with the given names) in chronological order.
+    """
+    files = list_vintage_files(source, disease, tests)
+    if names is not None:
+        files = [f for f in files if f.name in names]
+
+    # use the columnar vintage store for all files it contains (single scan instead of one read per file)
+    if store_available(source, disease, tests) and len(files) > 0:
+        vintages = read_vintages(source, disease, tests, [f.name[:10] for f in files])
+    else:
+        vintages = {}
+    
+    return [vintages.get(f.name[:10], f) for f in files]
+
+def latest_data_path(source, disease, tests=False):
+    return f'{config.DATA_PATH}/{source}/latest_data-{source}-{disease}{"-tests" if tests else ""}.csv'
+
+def compute_latest_data(source, disease, tests=False, incremental=False):
+    """
+    Combines the file history to the latest available data.
+    With incremental=True, the existing latest data is only updated with the files added since the last incremental run
+    (the included files and their hashes are recorded next to it, see vintage_store.included_path).
+    If a recorded file was changed or removed or the new files are not the newest ones, all files are combined again.
+    This is not possible for sources that are aggregated across states afterwards (Survstat, AGI, AGI_abs).
+    """
+    path = latest_data_path(source, disease, tests)
+    incremental = incremental and source not in ['Survstat', 'AGI', 'AGI_abs']
+
+    if incremental:
+        hashes = {f.name: file_hash(f) for f in list_vintage_files(source, disease, tests)}
+        included = load_included(path)
+        new_files = [f for f in hashes if f not in included]
+        if len(new_files) == 0 and included == hashes and os.path.exists(path):
+            return
+        if (os.path.exists(path) and len(included) > 0 and all(hashes.get(f) == md5 for f, md5 in included.items())
+                and min(new_files) > max(included)):
+            files = [read_csv(path, 'latest_data')] + load_file_history(source, disease, tests, names=new_files)
+        else:
+            files = load_file_history(source, disease, tests)
+    else:
+        files = load_file_history(source, disease, tests)
     
     df = combine_file_history(files)
     
     if source == 'Survstat' and disease != 'covid19':
-        df_history = pd.read_csv(f'../data/Survstat/history-survstat-{disease}.csv')
+        df_history = read_csv(f'{config.DATA_PATH}/Survstat/history-survstat-{disease}.csv', 'vintage')
         df = pd.concat([df_history, df])
     
     if source in ['Survstat', 'AGI', 'AGI_abs']:
-        df.location = df.location.replace(STATE_DICT)
-        df = df.groupby(['date', 'year', 'week', 'location', 'age_group']).sum().reset_index()
+        df.location = replace_values(df.location, STATE_DICT)
+        df = df.groupby(['date', 'year', 'week', 'location', 'age_group'], observed=True).sum().reset_index()
         
     df = df.sort_values(['location', 'age_group', 'date'])
     if source != "SARI_inc":
         df.value = df.value.astype('Int64')
-    df.to_csv(f'../data/{source}/latest_data-{source}-{disease}{"-tests" if tests else ""}.csv', index=False)
+    set_rows(rows_out=len(df))
+    write_csv(df, path, kind='latest_data')
 
-    
-for source in SOURCE_DICT.keys():
-    print('___________')
-    print(source)
-    
-    for disease in SOURCE_DICT[source]:
-        if source in ['NRZ', 'CVN']:
-            compute_latest_data(source, disease)
-            compute_latest_data(source, disease, tests=True)
-        else:
-            compute_latest_data(source, disease)
+    if incremental:
+        save_included(path, hashes)
+
+def main(incremental=False):
+    # with incremental=True the latest data is only updated with the files added since the last run
+    jobs = []
+    for source in SOURCE_DICT.keys():
+        for disease in SOURCE_DICT[source]:
+            jobs.append((f'{source}/{disease}', (source, disease), {'incremental': incremental}))
+            if source in ['NRZ', 'CVN']:
+                jobs.append((f'{source}/{disease}-tests', (source, disease), {'tests': True, 'incremental': incremental}))
+
+    return run_jobs(compute_latest_data, jobs)
+
+
+if __name__ == '__main__':
+    if len(main(incremental=os.environ.get('INCREMENTAL') == '1')) > 0:
+        raise SystemExit(1)
@@ -1,48 +1,19 @@
 import os
-import re
-import requests
 import pandas as pd
 from pathlib import Path
 from epiweeks import Week
-
-def get_all_date_tags(owner, repo):
-    # Define the GitHub API URL for tags
-    tags_url = f"https://api.github.com/repos/{owner}/{repo}/tags"
-    
-    # Send a GET request to retrieve the list of tags
-    response = requests.get(tags_url)
-    
-    if response.status_code == 200:
-        # Parse the JSON response to get the list of tags
-        tags_data = response.json()
-        
-        # Filter tags that match the "yyyy-mm-dd" format
-        date_tags = [tag["name"] for tag in tags_data if re.match(r'\d{4}-\d{2}-\d{2}', tag["name"])]
-        
-        return date_tags
-    else:
-        # Handle errors, e.g., repository not found or authentication issues
-        print(f"Failed to retrieve tags. Status code: {response.status_code}")
-        return []
-
-def load_file_from_tag(owner, repo, filepath, tag):
-    # Get the commit sha associated with the given tag
-    tag_url = f"https://api.github.com/repos/{owner}/{repo}/git/refs/tags/{tag}"
-    tag_response = requests.get(tag_url)
-    tag_data = tag_response.json()
-    sha = tag_data["object"]["sha"]
-
-    # Load the corresponding data in TSV format
-    raw_data_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{sha}/{filepath}"
-    data = pd.read_csv(raw_data_url, sep='\t')
-    
-    return data
+from week_functions import iso_enddate
+from vintage_store import update_store
+from github_functions import get_all_date_tags, get_new_tags, load_file_from_tag, update_tag_manifest
+from population import incidence_to_counts, population_dict
+from instrumentation import stage, write_report
+import config
 
 def previous_sunday(date):
     return str((Week.fromdate(pd.to_datetime(date), system='iso') - 1).enddate())
 
 def preprocess_sari(df):
-    df = df.drop(columns=['Saison', 'SARI'], errors='ignore')
+    df = df.drop(columns=['Saison'], errors='ignore')
 
     df = df.rename(columns={'Kalenderwoche' : 'date',
                             'Altersgruppe' : 'age_group',
@@ -53,21 +24,34 @@ def preprocess_sari(df):
     
     df.age_group = df.age_group.replace(AGE_GROUPS)
 
-    df.date = df.date.apply(lambda x: Week(int(x[:4]), int(x[6:]), system="iso"))
-    df['week'] = df.date.apply(lambda x: x.week)
-    df['year'] = df.date.apply(lambda x: x.year)
-    df.date = df.date.apply(lambda x: x.enddate())
+    df['year'] = df.date.str[:4].astype(int)
+    df['week'] = df.date.str[6:].astype(int)
+    df.date = iso_enddate(df.year, df.week)
     
     df['location'] = 'DE'
     
+    return df[['SARI', 'date', 'year', 'week', 'location', 'age_group', 'value']]
+
+def process_tag(df, date, absolute=True, incidence=True):
+    """
+    Processes all SARI categories of a tag in one pass and writes the absolute counts (SARI) and/or incidences (SARI_inc).
+    """
+    df = preprocess_sari(df)
+
     # convert from incidence (per 100,000) to absolute counts
-    population = pd.read_csv('https://raw.githubusercontent.com/KITmetricslab/RESPINOW-Hub/main/respinow_viz/plot_data/other/population_sizes.csv', 
-                        usecols=['location', 'age_group', 'population'])
-    population = population[population.location == 'DE']
-    pop_dict = dict(zip(population.age_group, population.population))
-    df.value = df.apply(lambda x: int(x['value']*pop_dict[x['age_group']]/100000), axis=1)
-    
-    return df[['date', 'year', 'week', 'location', 'age_group', 'value']]
+    if absolute:
+        df['count'] = incidence_to_counts(df.value, df.age_group, population_dict('DE'))
+
+    for c, df_temp in df.groupby('SARI', sort=False):
+        print(f' - {c}')
+        df_temp = df_temp.sort_values(['date', 'location', 'age_group'], ignore_index=True)
+        filename = f'{previous_sunday(date)}-icosari-{SARI_DICT[c]}.csv'
+
+        if incidence:
+            df_temp[COLUMNS].to_csv(f'{config.DATA_PATH}/SARI_inc/{SARI_DICT[c]}/{filename}', index=False)
+        if absolute:
+            df_temp = df_temp.drop(columns='value').rename(columns={'count': 'value'})
+            df_temp[COLUMNS].to_csv(f'{config.DATA_PATH}/SARI/{SARI_DICT[c]}/{filename}', index=False)
 
 OWNER = "robert-koch-institut"
 REPO = "SARI-Hospitalisierungsinzidenz"
@@ -80,26 +64,47 @@ SARI_DICT = {
     'RSV': 'sari_rsv'
 }
 
-tags = get_all_date_tags(OWNER, REPO)
-print("List of tags:", tags)
+COLUMNS = ['date', 'year', 'week', 'location', 'age_group', 'value']
 
-for s in SARI_DICT.values():
-    os.makedirs(f'../data/SARI/{s}/', exist_ok=True)
+# absolute counts are only computed for tags from this date on
+ABSOLUTE_START = '2024-10-10'
 
-# path = Path('../data/SARI/sari/')
-# os.makedirs(path, exist_ok=True)
-# dates_processed = sorted([file.name[:10] for file in path.glob('*.csv')])
-# new_dates = [date for date in tags if previous_sunday(date) not in dates_processed]
-new_dates = [t for t in tags if t >= '2024-10-10']
+def is_ingested(date):
+    filenames = [f'{s}/{previous_sunday(date)}-icosari-{s}.csv' for s in SARI_DICT.values()]
+    return (all(os.path.exists(f'{config.DATA_PATH}/SARI_inc/{f}') for f in filenames) and
+            (date < ABSOLUTE_START or all(os.path.exists(f'{config.DATA_PATH}/SARI/{f}') for f in filenames)))
 
-for date in new_dates:
-    print(date)
-    df = load_file_from_tag(OWNER, REPO, FILEPATH, date)
+def main():
+    tag_manifest = f'{config.DATA_PATH}/SARI/tag_manifest.csv'
+    tags = get_all_date_tags(OWNER, REPO, with_sha=True)
+    print("List of tags:", list(tags))
 
-    for c in df.SARI.unique():
-        print(f' - {c}')
-        df_temp = df[df.SARI == c]
-        df_temp = preprocess_sari(df_temp)
-        df_temp = df_temp.sort_values(['date', 'location', 'age_group'], ignore_index=True)
-        df_temp.to_csv(f'../data/SARI/{SARI_DICT[c]}/{previous_sunday(date)}-icosari-{SARI_DICT[c]}.csv', index=False)
-    
+    for s in SARI_DICT.values():
+        os.makedirs(f'{config.DATA_PATH}/SARI/{s}/', exist_ok=True)
+        os.makedirs(f'{config.DATA_PATH}/SARI_inc/{s}/', exist_ok=True)
+
+    # only tags that were not ingested before (or were moved to another commit) are downloaded,
+    # every tag is downloaded once and used for both the absolute counts and the incidences
+    new_tags = get_new_tags(tags, tag_manifest, is_ingested)
+
+    for date, sha in new_tags.items():
+        try:
+            print(date)
+            with stage('ingest_tag', source='SARI', data_version=previous_sunday(date)):
+                df = load_file_from_tag(OWNER, REPO, FILEPATH, date, sha)
+                process_tag(df, date, absolute=date >= ABSOLUTE_START)
+                update_tag_manifest(tag_manifest, date, sha)
+        except Exception as e:
+            print(f"Error processing date {date}: {e}")
+            continue
+
+    for s in SARI_DICT.values():
+        with stage('update_store', source='SARI', disease=s):
+            update_store('SARI', s)
+            update_store('SARI_inc', s)
+
+    write_report('get_sari')
+
+
+if __name__ == '__main__':
+    main()
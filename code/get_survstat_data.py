@@ -1,11 +1,17 @@
 import os
+import json
 import numpy as np
 import pandas as pd
-import requests
+import http_client
+from io import BytesIO
 from pathlib import Path
-from epiweeks import Week
+from week_functions import iso_enddate, iso_week, iso_year, week_enddate
+from vintage_store import update_store
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import count, set_rows, stage, write_report
 import datetime 
 from datetime import datetime 
+import config
 
 
 def ages_by_group(age_group):
@@ -16,15 +22,25 @@ def ages_by_group(age_group):
     return dict.fromkeys(keys, age_group)
 
 
+def map_unique(series, func):
+    """
+    Applies func (a function of a series) only to the distinct values and maps the results back to all rows.
+    The files repeat a few strata (states, single-year age groups) for every week.
+    """
+    codes, uniques = pd.factorize(series)
+    # code -1 (missing value) is mapped to the appended NaN
+    values = np.append(np.asarray(func(pd.Series(uniques)), dtype=object), np.nan)
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+
 def process_state_file(df):
     # add iso date (end date of the corresponding week)
-    df['date'] = df.apply(lambda x: Week(x.year, x.week, system='iso').enddate(), axis=1)
+    df['date'] = iso_enddate(df.year, df.week)
 
     df = df.rename(columns={'stratum': 'location'})
 
     # fix state names and replace with abbreviations
-    df.location = df.location.replace({'Ã.': 'ü', '\.': '-'}, regex=True)
-    df.location = df.location.replace(LOCATION_CODES)
+    df.location = map_unique(df.location, lambda x: x.replace({'Ã.': 'ü', '\.': '-'}, regex=True).replace(LOCATION_CODES))
 
     # fill in age_group
     df['age_group'] = '00+'
@@ -37,7 +53,7 @@ def process_state_file(df):
 
 def process_age_file(df):
     # add iso date (end date of the corresponding iso week)
-    df['date'] = df.apply(lambda x: Week(x.year, x.week, system='iso').enddate(), axis=1)
+    df['date'] = iso_enddate(df.year, df.week)
 
     df = df.rename(columns={'stratum': 'age_group'})
 
@@ -45,7 +61,7 @@ def process_age_file(df):
     df = df[df.age_group != "Unbekannt"]
 
     # summarize age groups (from yearly resolution to specified groups)
-    df.age_group = df.age_group.replace(AGE_DICT)
+    df.age_group = map_unique(df.age_group, lambda x: x.replace(AGE_DICT))
     df = df.groupby(['date', 'year', 'week', 'age_group'], as_index=False)['value'].sum()
 
     # compute sum for age group 00+
@@ -65,8 +81,8 @@ def process_age_file(df):
 
 def load_data(disease, date, sha):
     try:
-        df1 = pd.read_csv(f"{PATH}/{sha}/{disease}/{disease}-states-{date}.csv")
-        df2 = pd.read_csv(f"{PATH}/{sha}/{disease}/{disease}-age-{date}.csv")
+        df1 = pd.read_csv(BytesIO(http_client.get_raw(OWNER, REPO, sha, f"{disease}/{disease}-states-{date}.csv")))
+        df2 = pd.read_csv(BytesIO(http_client.get_raw(OWNER, REPO, sha, f"{disease}/{disease}-age-{date}.csv")))
 
         df1 = process_state_file(df1)
         df2 = process_age_file(df2)
@@ -84,9 +100,9 @@ def add_iso_dates(df):
     """
     Adds iso_week, iso_year and iso_date (end date of the week) to dataframe.
     """
-    df['iso_week'] = df.date.apply(lambda x: Week.fromdate(x, system='iso').week)
-    df['iso_year'] = df.date.apply(lambda x: Week.fromdate(x, system='iso').year)
-    df['iso_date'] = df.apply(lambda x: Week(x.iso_year, x.iso_week, system='iso'), axis=1)
+    df['iso_week'] = iso_week(df.date)
+    df['iso_year'] = iso_year(df.date)
+    df['iso_date'] = week_enddate(df.date)
 
     return df
 
@@ -94,7 +110,7 @@ def add_iso_dates(df):
 def list_all_files(disease, stratum='state'):
     # download all files from repo
     url = 'https://api.github.com/repos/KITmetricslab/nowcasting-data/git/trees/main?recursive=1'
-    r = requests.get(url)
+    r = http_client.get(url)
     res = r.json()
 
     # filter relevant files
@@ -110,42 +126,123 @@ def list_all_files(disease, stratum='state'):
     df_files.date = pd.to_datetime(df_files.date)
 
     df_files = add_iso_dates(df_files)
-    df_files['end_date'] = df_files.iso_date.apply(lambda x: x.enddate())
-    df_files['thursday_date'] = df_files.iso_date.apply(lambda x: x.daydate(3))
+    df_files['end_date'] = df_files.iso_date
 
     # only keep data available on Thursday
-    df_files = df_files[df_files.date == df_files.thursday_date]
+    df_files = df_files[df_files.date.dt.weekday == 3]
      
     # only consider files that have not been downloaded before
-    path = Path(f'../data/Survstat/{DISEASE_DICT[disease]}/')
+    path = Path(f'{config.DATA_PATH}/Survstat/{DISEASE_DICT[disease]}/')
     existing_dates = pd.unique([f.name[:10] for f in path.glob('**/*') if f.name.endswith('.csv')])
     # df_files = df_files[~df_files.end_date.astype(str).isin(existing_dates)] # temporarily commented out to update
 
     return df_files
 
 
-def get_commits(disease, date, stratum):
-    response = requests.get(f'{API_PATH}/commits?path={disease}/{disease}-{stratum}-{date}.csv',
-                           headers = {'Authorization': f'token {TOKEN}'})
-    commits = response.json()
-    commit_data = {
-        'sha': [commit['sha'] for commit in commits],
-        'date': [commit['commit']['author']['date'] for commit in commits],
-    }
+def load_commit_cache():
+    """
+    Cache of commit lookups: the commits (with ETag) per file, the resolved sha per file date
+    and the time of the last check for changes per disease.
+    """
+    path = f'{config.DATA_PATH}/{COMMIT_CACHE_FILE}'
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'checked': {}, 'commits': {}, 'sha': {}}
+
+
+def save_commit_cache(cache):
+    path = f'{config.DATA_PATH}/{COMMIT_CACHE_FILE}'
+    with open(path + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def invalidate_changed_files(disease, cache):
+    """
+    Marks cached commit lists as stale for all files of the disease changed since the last check
+    (following the pagination of the GitHub API). If nothing changed, this costs a single request.
+    """
+    checked = cache['checked'].get(disease)
+    now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    if checked is None:
+        # first run, all files are looked up anyway
+        cache['checked'][disease] = now
+        return
+
+    # one day of overlap to be robust against delayed commit timestamps
+    since = (pd.Timestamp(checked) - pd.Timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    url = f'{API_PATH}/commits'
+    params = {'path': disease, 'since': since, 'per_page': 100}
+
+    commits = []
+    for page in range(MAX_COMMIT_PAGES):
+        response = http_client.get(url, params=params)
+        response.raise_for_status()
+        commits += response.json()
+
+        # the url of the next page already contains all parameters
+        url = response.links.get('next', {}).get('url')
+        params = None
+        if url is None:
+            break
+
+    if url is not None:
+        # too many changes (e.g. after a backfill), all files of the disease are checked again
+        for path, entry in cache['commits'].items():
+            if path.startswith(f'{disease}/'):
+                entry['stale'] = True
+    else:
+        for commit in commits:
+            details = http_client.get(f'{API_PATH}/commits/{commit["sha"]}').json()
+            for file in details.get('files', []):
+                if file['filename'] in cache['commits']:
+                    cache['commits'][file['filename']]['stale'] = True
+
+    cache['checked'][disease] = now
+
+
+def get_commits(disease, date, stratum, cache=None):
+    """
+    Commits of a file. Cached commit lists are reused unless they are marked as stale,
+    stale ones are refreshed with a conditional request (not counted against the rate limit if unchanged).
+    """
+    path = f'{disease}/{disease}-{stratum}-{date}.csv'
+    entry = cache['commits'].get(path) if cache is not None else None
 
-    df = pd.DataFrame(commit_data)
+    if entry is not None and not entry.get('stale', False):
+        count('cache_hits')
+    else:
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        response = http_client.get(f'{API_PATH}/commits?path={path}', headers=headers)
+
+        if response.status_code == 304:
+            entry['stale'] = False
+        else:
+            commits = response.json()
+            entry = {'etag': response.headers.get('ETag'),
+                     'commits': [[commit['sha'], commit['commit']['author']['date']] for commit in commits]}
+            # files without commits might still be created later
+            entry['stale'] = len(entry['commits']) == 0
+            if cache is not None:
+                cache['commits'][path] = entry
+
+    df = pd.DataFrame(entry['commits'], columns=['sha', 'date'])
     df.date = pd.to_datetime(df.date)
     df['stratum'] = stratum
     return df
 
 
-def get_sha(disease, date):
+def get_sha(disease, date, cache=None):
 
-    df1 = get_commits(disease, date, 'states')
+    df1 = get_commits(disease, date, 'states', cache)
     df1 = df1[df1.date.dt.hour < 21]
 
     
-    df2 = get_commits(disease, date, 'age')
+    df2 = get_commits(disease, date, 'age', cache)
     df2 = df2[df2.date.dt.hour < 21]
     
     df = pd.concat([df1, df2])
@@ -157,9 +254,14 @@ def get_sha(disease, date):
         return None
 
 
-PATH = 'https://raw.githubusercontent.com/KITmetricslab/nowcasting-data/'
-API_PATH = f'https://api.github.com/repos/KITmetricslab/nowcasting-data'
-TOKEN = os.environ['TOKEN']
+OWNER = 'KITmetricslab'
+REPO = 'nowcasting-data'
+API_PATH = f'https://api.github.com/repos/{OWNER}/{REPO}'
+# requests to the GitHub API are authenticated by http_client with the token from the environment (TOKEN)
+
+COMMIT_CACHE_FILE = 'Survstat/commit_cache.json'
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8)) # concurrent commit lookups (and files in batch mode)
+MAX_COMMIT_PAGES = 10 # pages of changed commits checked per disease, otherwise all files are checked again
 
 LOCATION_CODES = {'Deutschland': 'DE',
                   'Schleswig-Holstein': 'DE-SH',
@@ -193,15 +295,62 @@ DISEASE_DICT = {
 }
 
 
-for disease in DISEASE_DICT.keys():
-    print("____________________")
-    print(disease)
-    df_files = list_all_files(disease)
-    df_files['sha'] = df_files.date.apply(lambda x: get_sha(disease, x.date()))
-    df_files = df_files.dropna()
-    for index, row in df_files.iterrows():
-        print("Processing:", row.filename)
+def ingest_file(disease, row, target_path):
+    print("Processing:", row.filename)
+    with stage('ingest_file', source='Survstat', disease=DISEASE_DICT[disease], data_version=str(row.end_date)):
         df = load_data(disease, row.date.date(), row.sha)
-        target_path = f'../data/Survstat/{DISEASE_DICT[disease]}/{row.end_date}-survstat-{DISEASE_DICT[disease]}.csv'
+        set_rows(rows_out=len(df))
         df.to_csv(target_path, index = False)
-        print("Saving to:", target_path)
+
+
+def main(batch=False):
+    """
+    With batch=True (environment variable BATCH=1), up to MAX_WORKERS files are processed at the same time,
+    e.g. to download the complete history again. The files are the same as when processed one by one.
+    """
+    commit_cache = load_commit_cache()
+
+    for disease in DISEASE_DICT.keys():
+        print("____________________")
+        print(disease)
+        df_files = list_all_files(disease)
+
+        with stage('resolve_commits', source='Survstat', disease=DISEASE_DICT[disease]):
+            invalidate_changed_files(disease, commit_cache)
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                df_files['sha'] = list(executor.map(lambda x: get_sha(disease, x.date(), commit_cache), df_files.date))
+        df_files = df_files.dropna()
+
+        jobs = []
+        for index, row in df_files.iterrows():
+            # skip files that were already processed from the same commit
+            target_path = f'{config.DATA_PATH}/Survstat/{DISEASE_DICT[disease]}/{row.end_date}-survstat-{DISEASE_DICT[disease]}.csv'
+            key = f'{disease}/{row.date.date()}'
+            if commit_cache['sha'].get(key) == row.sha and os.path.exists(target_path):
+                continue
+            jobs.append((row, target_path, key))
+
+        if batch:
+            # download, process and write the files concurrently, the commit cache is only updated here
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = [executor.submit(ingest_file, disease, row, target_path) for row, target_path, key in jobs]
+                for (row, target_path, key), future in zip(jobs, futures):
+                    future.result()
+                    commit_cache['sha'][key] = row.sha
+                    print("Saving to:", target_path)
+        else:
+            for row, target_path, key in jobs:
+                ingest_file(disease, row, target_path)
+                commit_cache['sha'][key] = row.sha
+                print("Saving to:", target_path)
+
+        save_commit_cache(commit_cache)
+
+        with stage('update_store', source='Survstat', disease=DISEASE_DICT[disease]):
+            update_store('Survstat', DISEASE_DICT[disease])
+
+    write_report('get_survstat_data')
+
+
+if __name__ == '__main__':
+    main(batch=os.environ.get('BATCH') == '1')
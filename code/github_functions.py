@@ -0,0 +1,86 @@
+import os
+import re
+import pandas as pd
+from io import BytesIO
+import http_client
+from job_runner import write_csv
+
+
+def get_all_date_tags(owner, repo, with_sha=False):
+    """
+    All tags in "yyyy-mm-dd" format (following the pagination of the GitHub API).
+    With with_sha=True, a dictionary mapping the tags to their commit sha is returned.
+    """
+    # Define the GitHub API URL for tags
+    url = f"https://api.github.com/repos/{owner}/{repo}/tags"
+    params = {'per_page': 100}
+
+    tags = {}
+    while url is not None:
+        # Send a GET request to retrieve the next page of tags
+        response = http_client.get(url, params=params)
+
+        if response.status_code != 200:
+            # Handle errors, e.g., repository not found or authentication issues
+            print(f"Failed to retrieve tags. Status code: {response.status_code}")
+            return {} if with_sha else []
+
+        # Filter tags that match the "yyyy-mm-dd" format
+        for tag in response.json():
+            if re.match(r'\d{4}-\d{2}-\d{2}', tag["name"]):
+                tags[tag["name"]] = tag["commit"]["sha"]
+
+        # the url of the next page already contains all parameters
+        url = response.links.get('next', {}).get('url')
+        params = None
+
+    return tags if with_sha else list(tags)
+
+def load_tag_manifest(path):
+    """
+    Manifest of the tags that were already ingested (tag, sha).
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['tag', 'sha'])
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def update_tag_manifest(path, tag, sha):
+    manifest = load_tag_manifest(path)
+    manifest = manifest[manifest.tag != tag]
+    manifest = pd.concat([manifest, pd.DataFrame({'tag': [tag], 'sha': [sha]})])
+    write_csv(manifest.sort_values('tag'), path)
+
+def get_new_tags(tags, manifest_path, is_ingested=None):
+    """
+    Tags (dictionary mapping tags to commit sha) that are not yet in the manifest or point to a different commit.
+    If there is no manifest yet, it is created from the tags for which is_ingested(tag) is true.
+    These entries have no sha and count as ingested.
+    """
+    if not os.path.exists(manifest_path) and is_ingested is not None:
+        write_csv(pd.DataFrame({'tag': sorted(t for t in tags if is_ingested(t)), 'sha': ''}), manifest_path)
+
+    manifest = load_tag_manifest(manifest_path)
+    ingested = dict(zip(manifest.tag, manifest.sha))
+    return {tag: sha for tag, sha in sorted(tags.items())
+            if tag not in ingested or ingested[tag] not in ['', sha]}
+
+def load_file_from_tag(owner, repo, filepath, tag, sha=None):
+    # Get the commit sha associated with the given tag (unless it is already known from the list of tags)
+    if sha is None:
+        tag_url = f"https://api.github.com/repos/{owner}/{repo}/git/refs/tags/{tag}"
+        tag_response = http_client.get(tag_url)
+        tag_data = tag_response.json()
+        sha = tag_data["object"]["sha"]
+
+    # Load the corresponding data in TSV format (cached locally, the content at a sha never changes)
+    data = pd.read_csv(BytesIO(http_client.get_raw(owner, repo, sha, filepath)), sep='\t')
+
+    return data
+
+def get_latest_file_sha(owner, repo, filepath):
+    # Get the sha of the latest commit that changed the given file
+    commits_url = f"https://api.github.com/repos/{owner}/{repo}/commits"
+    response = http_client.get(commits_url, params={'path': filepath, 'per_page': 1})
+    response.raise_for_status()
+
+    return response.json()[0]["sha"]
@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from pathlib import Path
+from instrumentation import count
+
+# Shared HTTP client for all fetchers: pooled keep-alive connections, retries with exponential backoff
+# on 429/5xx, waiting for the GitHub rate limit to reset and an on-disk cache for immutable content
+# (files on raw.githubusercontent.com requested by commit sha never change).
+
+CACHE_PATH = Path(os.environ.get('HTTP_CACHE', '../.cache/http/'))
+POOL_SIZE = 16
+MAX_RATE_LIMIT_WAIT = 15 * 60 # seconds
+
+_local = threading.local()
+
+
+def get_session():
+    """
+    Session of the current thread (sessions are not guaranteed to be thread-safe).
+    """
+    if not hasattr(_local, 'session'):
+        # requests is only imported when the first request is made, so importing the fetchers does not load it
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET', 'HEAD'], respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _local.session = session
+    return _local.session
+
+
+def _github_headers(url, headers):
+    """
+    Authenticates requests to the GitHub API with the token from the environment (if available),
+    which increases the rate limit from 60 to 5000 requests per hour.
+    """
+    headers = dict(headers or {})
+    token = os.environ.get('TOKEN') or os.environ.get('AUTH')
+    if url.startswith('https://api.github.com') and token and 'Authorization' not in headers:
+        headers['Authorization'] = f'token {token}'
+    return headers
+
+
+def _rate_limit_wait(response):
+    """
+    Seconds until the GitHub rate limit resets if it is exhausted, otherwise None.
+    """
+    if response.status_code in [403, 429] and response.headers.get('X-RateLimit-Remaining') == '0':
+        reset = int(response.headers.get('X-RateLimit-Reset', time.time()))
+        return max(reset - time.time(), 0) + 1
+    return None
+
+
+def request(method, url, headers=None, **kwargs):
+    headers = _github_headers(url, headers)
+    count('http_requests')
+    response = get_session().request(method, url, headers=headers, **kwargs)
+
+    wait = _rate_limit_wait(response)
+    if wait is not None and wait <= MAX_RATE_LIMIT_WAIT:
+        print(f'GitHub rate limit exceeded, waiting {wait:.0f} seconds.')
+        time.sleep(wait)
+        count('http_requests')
+        response = get_session().request(method, url, headers=headers, **kwargs)
+
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    return request('HEAD', url, **kwargs)
+
+
+def write_cache(content, path):
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def get_raw(owner, repo, sha, filepath):
+    """
+    Content of a file in a GitHub repository at the given commit.
+    As the content at a commit sha never changes, it is downloaded only once and then read from the disk cache.
+    Raises requests.HTTPError if the file does not exist.
+    """
+    path = CACHE_PATH / 'raw' / owner / repo / sha / filepath
+    if path.exists():
+        count('cache_hits')
+        return path.read_bytes()
+
+    response = get(f'https://raw.githubusercontent.com/{owner}/{repo}/{sha}/{filepath}')
+    response.raise_for_status()
+    write_cache(response.content, path)
+    return response.content
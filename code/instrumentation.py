@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+import cProfile
+import resource
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+# Per-stage instrumentation of pipeline runs. A stage records its wall and CPU time, the files and bytes
+# read and written, HTTP requests and cache hits, rows in/out (if set by the stage) and the peak RSS of the process.
+# Files, HTTP requests and cache hits are counted per thread: a count goes to the open stages of the counting thread,
+# or to all open stages if the thread has none (e.g. worker threads started by a stage). CPU time and bytes are only
+# available for the whole process, so they are None for stages that ran at the same time as a stage of another
+# thread (e.g. files processed concurrently in batch mode).
+# If the environment variable RUN_REPORT is set, the stages are appended to this JSON file at the end of a script.
+# With PROFILE_JOB=<stage or job name>, the matching stage is run with cProfile (dump in PROFILE_DIR).
+
+COUNTERS = ['files_read', 'files_written', 'http_requests', 'cache_hits']
+
+_lock = threading.Lock()
+_local = threading.local()
+_open = []
+_records = []
+_started = time.perf_counter()
+
+
+def count(counter, n=1):
+    with _lock:
+        thread = threading.get_ident()
+        stages = [s for s in _open if s['thread'] == thread] or _open
+        for s in stages:
+            s['counters'][counter] += n
+
+
+def _io_bytes():
+    """
+    Bytes read and written by the process (Linux only, includes network I/O).
+    """
+    try:
+        with open('/proc/self/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+        return {'bytes_read': int(io['rchar']), 'bytes_written': int(io['wchar'])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def set_rows(rows_in=None, rows_out=None):
+    """
+    Sets the number of input and/or output rows of the current stage (ignored outside of stages).
+    """
+    stack = getattr(_local, 'stack', [])
+    if len(stack) > 0:
+        if rows_in is not None:
+            stack[-1]['rows_in'] = int(rows_in)
+        if rows_out is not None:
+            stack[-1]['rows_out'] = int(rows_out)
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Records a stage, e.g. with stage('reporting_triangle', source='NRZ', disease='influenza', tests=True): ...
+    """
+    record = {'stage': name, **labels}
+    state = {'thread': threading.get_ident(), 'counters': dict.fromkeys(COUNTERS, 0), 'overlapped': False}
+    with _lock:
+        # stages of other threads that are still running overlap with this one
+        for s in _open:
+            if s['thread'] != state['thread']:
+                s['overlapped'] = state['overlapped'] = True
+        _open.append(state)
+    io = _io_bytes()
+    start, cpu_start = time.perf_counter(), time.process_time()
+
+    profiler = None
+    profile_job = os.environ.get('PROFILE_JOB')
+    if profile_job is not None and profile_job in [name, labels.get('job')]:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(record)
+    try:
+        yield record
+        record['status'] = 'ok'
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        _local.stack.pop()
+
+        if profiler is not None:
+            profiler.disable()
+            profile_dir = Path(os.environ.get('PROFILE_DIR', '.'))
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_name = re.sub(r'[^\w.-]+', '_', str(labels.get('job', name))).strip('._')
+            profiler.dump_stats(profile_dir / f'{profile_name}.prof')
+
+        record['seconds'] = time.perf_counter() - start
+        with _lock:
+            _open[:] = [s for s in _open if s is not state]
+            record['cpu_seconds'] = None if state['overlapped'] else time.process_time() - cpu_start
+            record.update(state['counters'])
+            record.update({k: None if state['overlapped'] else v - io[k] for k, v in _io_bytes().items() if k in io})
+            record['peak_rss_mb'] = _peak_rss_mb()
+            _records.append(record)
+
+
+def pop_records():
+    """
+    Returns and removes all finished stages of this process (used to send them from worker processes).
+    """
+    with _lock:
+        records = list(_records)
+        _records.clear()
+    return records
+
+
+def write_report(script, records=None):
+    """
+    Appends the stages of a script run to the JSON report given by RUN_REPORT (if set).
+    """
+    records = pop_records() if records is None else records
+    path = os.environ.get('RUN_REPORT')
+    if not path:
+        return
+
+    path = Path(path)
+    report = json.loads(path.read_text()) if path.exists() else {'runs': []}
+    report['runs'].append({'script': script,
+                           'finished': datetime.now().isoformat(timespec='seconds'),
+                           'seconds': time.perf_counter() - _started,
+                           'peak_rss_mb': _peak_rss_mb(),
+                           'stages': records})
+
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    tmp_path.write_text(json.dumps(report, indent=1))
+    os.replace(tmp_path, path)
@@ -0,0 +1,78 @@
+import os
+import sys
+import traceback
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from instrumentation import count, pop_records, stage, write_report
+from schemas import write_binary
+
+
+def get_workers(workers=None):
+    """
+    Number of worker processes: argument, environment variable WORKERS or number of cores.
+    """
+    if workers is None:
+        workers = int(os.environ.get('WORKERS', os.cpu_count() or 1))
+    return max(1, workers)
+
+
+def write_csv(df, path, kind=None, **kwargs):
+    """
+    Writes the dataframe to a temporary file first and then replaces the target,
+    so readers (and parallel jobs) never see partially written files.
+    For outputs of a known kind (see schemas.py), a binary copy is written as well if BINARY_FORMAT is set.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    df.to_csv(tmp_path, index=False, **kwargs)
+    os.replace(tmp_path, path)
+    count('files_written')
+
+    if kind is not None:
+        write_binary(path, kind)
+
+
+def _run_job(func, name, args, kwargs):
+    """
+    Runs a job as instrumented stage. Returns the traceback (None if successful) and the recorded stages.
+    """
+    try:
+        with stage(func.__name__, job=name):
+            func(*args, **kwargs)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return error, pop_records()
+
+
+def run_jobs(func, jobs, workers=None):
+    """
+    Runs func for every job in a process pool. Jobs are tuples (name, args, kwargs).
+    A failing job does not stop the others, errors are reported at the end.
+    Returns a dictionary mapping the names of failed jobs to their tracebacks.
+    The stages recorded by the jobs are written to the run report (see instrumentation.py).
+    """
+    workers = get_workers(workers)
+    errors = {}
+    records = []
+
+    if workers == 1:
+        for name, args, kwargs in jobs:
+            errors[name], job_records = _run_job(func, name, args, kwargs)
+            records += job_records
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(_run_job, func, name, args, kwargs) for name, args, kwargs in jobs}
+            for name, future in futures.items():
+                errors[name], job_records = future.result()
+                records += job_records
+
+    errors = {name: error for name, error in errors.items() if error is not None}
+
+    print(f'Finished {len(jobs) - len(errors)} of {len(jobs)} jobs.')
+    for name, error in errors.items():
+        print(f'___________\nFailed: {name}\n{error}')
+
+    write_report(Path(sys.argv[0]).stem or func.__name__, records)
+
+    return errors
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+from pathlib import Path
+from job_runner import run_jobs
+from vintage_store import file_hash, list_vintage_files
+from get_latest_data import compute_latest_data, latest_data_path
+from reporting_triangles import SOURCE_DICT, compute_reporting_triangle, triangle_path, update_reporting_triangle
+import asof
+from compute_target import target_path
+from preprocess_reporting_triangles import preprocessed_path
+from postprocess_reporting_triangles import postprocess_file
+import config
+
+# Runs the pipeline latest_data -> reporting_triangle -> postprocessed (preprocessed triangle and target)
+# for all (source, disease, tests),
+# the as-of indexes of the vintages (asof_index) only depend on the vintages.
+# For every target, the content hashes of its inputs (data files and the code computing it) are recorded in
+# pipeline_state.json in the data directory. A target is only rebuilt if one of its inputs changed or its outputs are missing or were modified,
+# e.g. a new CVN vintage only rebuilds the CVN targets.
+# Files are recorded relative to the data directory (data) and the repository (code, e.g. 'code/schemas.py'),
+# so the state does not depend on where the repository is checked out.
+# Usage: python pipeline.py [stage ...]   (default: all stages, in the order of STAGES)
+# With INCREMENTAL=1, latest data and reporting triangles are updated incrementally (see the corresponding scripts).
+
+STATE_FILE = 'pipeline_state.json'
+STAGES = ['latest_data', 'reporting_triangle', 'postprocessed', 'asof_index']
+# preprocessed triangles and targets are computed together
+STAGE_ALIASES = {'preprocessed': 'postprocessed', 'target': 'postprocessed'}
+
+CODE_PATH = Path(__file__).resolve().parent
+# modules whose code determines the outputs of a stage (the module of the function and the helpers it uses)
+CODE_INPUTS = {
+    'latest_data': ['get_latest_data.py', 'vintage_store.py', 'schemas.py', 'job_runner.py'],
+    'reporting_triangle': ['reporting_triangles.py', 'week_functions.py', 'vintage_store.py', 'schemas.py', 'job_runner.py'],
+    'postprocessed': ['postprocess_reporting_triangles.py', 'preprocess_reporting_triangles.py', 'compute_target.py',
+                      'schemas.py', 'job_runner.py'],
+    'asof_index': ['asof.py', 'reporting_triangles.py', 'week_functions.py', 'vintage_store.py', 'schemas.py']
+}
+
+
+def make_targets(incremental=False):
+    """
+    Declares all targets as dictionaries with name, stage, function, arguments, inputs and outputs.
+    The inputs of a target include the outputs of the targets it depends on (and the code of its stage, see CODE_INPUTS).
+    """
+    targets = []
+    for source in SOURCE_DICT.keys():
+        for disease in SOURCE_DICT[source]:
+            for tests in ([False, True] if source in ['NRZ', 'CVN'] else [False]):
+                key = f'{source}/{disease}{"-tests" if tests else ""}'
+                vintages = list_vintage_files(source, disease, tests)
+                history = ([Path(f'{config.DATA_PATH}/Survstat/history-survstat-{disease}.csv')]
+                           if source == 'Survstat' and disease != 'covid19' else [])
+                latest_data = Path(latest_data_path(source, disease, tests))
+                triangle = Path(triangle_path(source, disease, tests))
+                compute_triangle = update_reporting_triangle if incremental else compute_reporting_triangle
+
+                targets += [
+                    {'name': f'latest_data:{key}', 'stage': 'latest_data',
+                     'func': compute_latest_data, 'args': (source, disease),
+                     'kwargs': {'tests': tests, 'incremental': incremental},
+                     'inputs': vintages + history, 'outputs': [latest_data]},
+                    {'name': f'reporting_triangle:{key}', 'stage': 'reporting_triangle',
+                     'func': compute_triangle, 'args': (source, disease),
+                     'kwargs': {'tests': tests, 'prospective': source == 'Survstat'},
+                     'inputs': vintages + [latest_data], 'outputs': [triangle]},
+                    {'name': f'postprocessed:{key}', 'stage': 'postprocessed',
+                     'func': postprocess_file, 'args': (triangle,), 'kwargs': {},
+                     'inputs': [triangle], 'outputs': [preprocessed_path(triangle), target_path(triangle)]},
+                    {'name': f'asof_index:{key}', 'stage': 'asof_index',
+                     'func': asof.build_index, 'args': (source, disease), 'kwargs': {'tests': tests},
+                     'inputs': vintages, 'outputs': [asof.index_path(source, disease, tests) / f
+                                                     for f in ['index.json'] + [f'{a}.npy' for a in asof.ARRAYS]]}
+                ]
+
+    return targets
+
+
+def load_state():
+    path = config.DATA_PATH / STATE_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_state(state):
+    path = config.DATA_PATH / STATE_FILE
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    tmp_path.write_text(json.dumps(state, indent=1, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def state_key(path):
+    """
+    Name of a file in the state: relative to the data directory or (code) to the repository.
+    """
+    path = Path(path).resolve()
+    if path.is_relative_to(CODE_PATH):
+        return path.relative_to(CODE_PATH.parent).as_posix()
+    return path.relative_to(config.DATA_PATH.resolve()).as_posix()
+
+
+def hash_files(paths, hashes):
+    """
+    Content hashes of the given files (None for missing files), computed at most once per file and run.
+    """
+    result = {}
+    for path in paths:
+        key = state_key(path)
+        if key not in hashes:
+            hashes[key] = file_hash(path) if os.path.exists(path) else None
+        result[key] = hashes[key]
+    return result
+
+
+def target_inputs(target):
+    # the code computing a target is an input as well
+    return target['inputs'] + [CODE_PATH / f for f in CODE_INPUTS[target['stage']]]
+
+
+def is_up_to_date(target, state, hashes):
+    if target['name'] not in state:
+        return False
+    recorded = state[target['name']]
+    outputs = hash_files(target['outputs'], hashes)
+    return (recorded['inputs'] == hash_files(target_inputs(target), hashes) and
+            None not in outputs.values() and recorded['outputs'] == outputs)
+
+
+def run_stage(stage, targets, state):
+    """
+    Rebuilds all targets of a stage that are not up to date. Returns the names of the failed targets.
+    """
+    hashes = {}
+    targets = [t for t in targets if t['stage'] == stage]
+    outdated = [t for t in targets if not is_up_to_date(t, state, hashes)]
+    print(f'{stage}: {len(outdated)} of {len(targets)} targets to rebuild.')
+    if len(outdated) == 0:
+        return []
+
+    # run_jobs expects a single function, so the function of each target is passed as first argument
+    jobs = [(t['name'], (t['func'],) + tuple(t['args']), t['kwargs']) for t in outdated]
+    errors = run_jobs(run_target, jobs)
+
+    # outputs have changed, hashes are computed again
+    hashes = {}
+    for t in outdated:
+        if t['name'] in errors:
+            state.pop(t['name'], None)
+        else:
+            state[t['name']] = {'inputs': hash_files(target_inputs(t), hashes),
+                                'outputs': hash_files(t['outputs'], hashes)}
+    save_state(state)
+
+    return list(errors)
+
+
+def run_target(func, *args, **kwargs):
+    func(*args, **kwargs)
+
+
+def main(stages=STAGES, incremental=False):
+    targets = make_targets(incremental)
+    state = load_state()
+
+    stages = [STAGE_ALIASES.get(stage, stage) for stage in stages]
+    failed = []
+    for stage in STAGES:
+        if stage in stages:
+            failed += run_stage(stage, targets, state)
+
+    return failed
+
+
+if __name__ == '__main__':
+    failed = main(sys.argv[1:] if len(sys.argv) > 1 else STAGES, incremental=os.environ.get('INCREMENTAL') == '1')
+    if len(failed) > 0:
+        raise SystemExit(1)
@@ -0,0 +1,51 @@
+import pandas as pd
+from io import BytesIO
+from functools import lru_cache
+import http_client
+from github_functions import get_latest_file_sha
+
+# Population sizes used to convert incidences to absolute counts.
+# The file is downloaded by commit sha (and therefore cached locally by http_client),
+# the version used last is remembered so that the cached copy can be used if GitHub is not reachable.
+
+OWNER = 'KITmetricslab'
+REPO = 'RESPINOW-Hub'
+FILEPATH = 'respinow_viz/plot_data/other/population_sizes.csv'
+VERSION_PATH = http_client.CACHE_PATH / 'population_sizes-version.txt'
+
+
+@lru_cache
+def load_population():
+    """
+    Loads the population table once per process.
+    """
+    try:
+        sha = get_latest_file_sha(OWNER, REPO, FILEPATH)
+    except Exception as e:
+        if not VERSION_PATH.exists():
+            raise
+        sha = VERSION_PATH.read_text().strip()
+        print(f"Could not check for new population sizes ({e}), using cached version {sha}.")
+
+    df = pd.read_csv(BytesIO(http_client.get_raw(OWNER, REPO, sha, FILEPATH)),
+                     usecols=['location', 'age_group', 'population'])
+
+    http_client.write_cache(f'{sha}\n'.encode(), VERSION_PATH)
+    return df
+
+
+def population_dict(location='DE'):
+    population = load_population()
+    population = population[population.location == location]
+    return dict(zip(population.age_group, population.population))
+
+
+def incidence_to_counts(values, age_groups, pop_dict):
+    """
+    Converts incidences (per 100,000) to absolute counts (truncated to integers).
+    """
+    population = age_groups.map(pop_dict)
+    if population.isna().any():
+        raise KeyError(f"No population size for age groups {list(age_groups[population.isna()].unique())}.")
+
+    return (values * population / 100000).astype('int64')
@@ -0,0 +1,42 @@
+import sys
+from job_runner import run_jobs, write_csv
+from instrumentation import count, set_rows
+from schemas import read_csv
+from preprocess_reporting_triangles import preprocess_triangle, preprocessed_path
+from compute_target import compute_target, target_path
+import config
+
+# Computes the preprocessed triangle and the targets of every reporting triangle in a single pass:
+# each triangle is read once, the files are processed in parallel (number of processes can be set with WORKERS).
+# Usage: python postprocess_reporting_triangles.py [max_delay ...]   (targets for the given maximum delays, default: 4)
+
+def postprocess_file(f, max_delays=(4,)):
+    print("Processing:", f)
+    df = read_csv(f, 'triangle')
+    count('files_read')
+    set_rows(rows_in=len(df))
+
+    df_preprocessed = preprocess_triangle(df, f.name)
+    write_csv(df_preprocessed, preprocessed_path(f), kind='triangle')
+    set_rows(rows_out=len(df_preprocessed))
+    for max_delay in max_delays:
+        df_target = compute_target(df, max_delay)
+        write_csv(df_target, target_path(f, max_delay), kind='target')
+
+    print("Done:", f)
+
+
+def main(max_delays=(4,)):
+    path = config.DATA_PATH
+    files = [f for f in path.rglob('*reporting_triangle*.csv') if 'preprocessed' not in f.name]
+
+    # targets are only computed for the current triangles (reporting_triangle-*), not for the legacy NRZ
+    # triangles (*_reporting_triangle.csv), which are only preprocessed
+    return run_jobs(postprocess_file, [(str(f), (f,), {'max_delays': max_delays if f.name.startswith('reporting_triangle') else ()})
+                                       for f in files])
+
+
+if __name__ == '__main__':
+    max_delays = [int(d) for d in sys.argv[1:]] if len(sys.argv) > 1 else [4]
+    if len(main(max_delays)) > 0:
+        raise SystemExit(1)
@@ -1,18 +1,32 @@
+import numpy as np
 import pandas as pd
-from pathlib import Path
+from job_runner import run_jobs, write_csv
+from instrumentation import count, set_rows
+from schemas import read_csv
+import config
 
 def preprocess_reporting_triangle(df):
-    for i, row in df.iterrows():
-        to_subtract = 0
-        for j, value in row[:4:-1].items():
-            if pd.notna(value):
-                value += to_subtract
-                if value < 0:
-                    to_subtract = value
-                    df.loc[i, j] = 0
-                else:
-                    df.loc[i, j] = value
-                    to_subtract = 0
+    """
+    Redistributes negative corrections: starting from the largest delay, negative values are set to zero
+    and subtracted from the next observed value at a smaller delay (until the remainder is absorbed).
+    """
+    value_cols = df.columns[5:]
+    values = df[value_cols].to_numpy(dtype=float, na_value=np.nan, copy=True)
+
+    # the loop runs over the delay columns only, all rows are processed at once
+    to_subtract = np.zeros(len(df))
+    for j in range(len(value_cols) - 1, -1, -1):
+        observed = ~np.isnan(values[:, j])
+        value = values[:, j] + to_subtract
+        values[:, j] = np.where(observed, np.where(value < 0, 0, value), values[:, j])
+        to_subtract = np.where(observed, np.where(value < 0, value, 0), to_subtract)
+
+    for j, col in enumerate(value_cols):
+        # integer columns (also nullable Int64, NaN becomes NA) stay integer as long as no fractional corrections were added
+        if pd.api.types.is_integer_dtype(df[col].dtype) and np.array_equal(values[:, j], np.round(values[:, j]), equal_nan=True):
+            df[col] = pd.array(values[:, j], dtype=df[col].dtype)
+        else:
+            df[col] = values[:, j]
 
     # value_cols = [c for c in df.columns if 'value' in c]
     # for col in value_cols:
@@ -21,21 +35,44 @@ def preprocess_reporting_triangle(df):
     return(df)
 
 
-path = Path('../data/')
-files = [f for f in path.rglob('*reporting_triangle*.csv') if 'preprocessed' not in f.name]
+def preprocessed_path(f):
+    return f.with_name(f.stem + "-preprocessed.csv")
 
-for f in files:
-    print("Processing:", f)
-    df = pd.read_csv(f)
+
+def preprocess_triangle(df, name):
+    """
+    Preprocessed triangle (delays up to 4 weeks) as written to the '-preprocessed' file of the triangle 'name'.
+    """
     df = df.loc[:, : 'value_4w']
-    if 'are' not in f.name:
+    if 'are' not in name:
         df = preprocess_reporting_triangle(df)
         value_cols = [c for c in df.columns if 'value' in c]
-        if 'sari_inc' not in f.name:
+        if 'sari_inc' not in name:
             df[value_cols] = df[value_cols].astype('Int64')
         else:
             df[value_cols] = df[value_cols].round(1)
     df = df.sort_values(['location', 'age_group', 'date'])
-    df.to_csv(f.with_name(f.stem + "-preprocessed.csv"), index = False)
-    print("Done:", f.with_name(f.stem + "-preprocessed.csv\n"))
-    
+    return df
+
+
+def process_file(f):
+    print("Processing:", f)
+    df = read_csv(f, 'triangle')
+    count('files_read')
+    set_rows(rows_in=len(df))
+    df = preprocess_triangle(df, f.name)
+    set_rows(rows_out=len(df))
+    write_csv(df, preprocessed_path(f), kind='triangle')
+    print("Done:", preprocessed_path(f), end="\n\n")
+
+
+def main():
+    path = config.DATA_PATH
+    files = [f for f in path.rglob('*reporting_triangle*.csv') if 'preprocessed' not in f.name]
+
+    return run_jobs(process_file, [(str(f), (f,), {}) for f in files])
+
+
+if __name__ == '__main__':
+    if len(main()) > 0:
+        raise SystemExit(1)
@@ -1,9 +1,15 @@
 import os
 import numpy as np
+from functools import lru_cache
 import pandas as pd
 from epiweeks import Week
-from tqdm.auto import tqdm
 from pathlib import Path
+from week_functions import iso_week, iso_year, week_enddate
+from vintage_store import file_hash, load_included, read_vintages, save_included, store_available
+from job_runner import run_jobs, write_csv
+from instrumentation import count, set_rows
+from schemas import read_csv, replace_values
+import config
 
 STATE_DICT = {
     'DE-BB' : 'DE-BB-BE', 
@@ -16,34 +22,40 @@ STATE_DICT = {
     'DE-HH' : 'DE-SH-HH'
 }
 
-def load_data(source, disease, date, tests=False):
+def prepare_data(df, source):
+    df.date = week_enddate(df.date)
+    
+    if source in ['Survstat', 'AGI', 'AGI_abs']:
+        df.location = replace_values(df.location, STATE_DICT)
+        df = df.groupby(['date', 'year', 'week', 'location', 'age_group'], observed=True).sum().reset_index()
+    
+    df = df.sort_values(['location', 'age_group', 'date'], ignore_index=True)
+
+    return df
+
+def data_path(source, disease, date, tests=False):
     if source == 'NRZ':
-        path = f'../data/NRZ/{disease}/{date}_{"AmountTested" if tests else "VirusDetections"}.csv'
+        return f'{config.DATA_PATH}/NRZ/{disease}/{date}_{"AmountTested" if tests else "VirusDetections"}.csv'
     elif source == 'SARI':
-        path = f'../data/SARI/{disease}/{date}-icosari-{disease}.csv'
+        return f'{config.DATA_PATH}/SARI/{disease}/{date}-icosari-{disease}.csv'
     elif source == 'SARI_inc':
-        path = f'../data/SARI_inc/{disease}/{date}-icosari-{disease}.csv'
+        return f'{config.DATA_PATH}/SARI_inc/{disease}/{date}-icosari-{disease}.csv'
     elif source == 'Survstat':
-        path = f'../data/Survstat/{disease}/{date}-survstat-{disease}.csv'
+        return f'{config.DATA_PATH}/Survstat/{disease}/{date}-survstat-{disease}.csv'
     elif source == 'CVN':
-        path = f'../data/CVN/{disease}/{date}-cvn-{disease}{"-tests" if tests else ""}.csv'
+        return f'{config.DATA_PATH}/CVN/{disease}/{date}-cvn-{disease}{"-tests" if tests else ""}.csv'
     elif source == 'AGI':
-        path = f'../data/AGI/{disease}/{date}-agi-{disease}.csv'
+        return f'{config.DATA_PATH}/AGI/{disease}/{date}-agi-{disease}.csv'
     elif source == 'AGI_abs':
-        path = f'../data/AGI_abs/{disease}/{date}-agi-{disease}.csv'
-    
+        return f'{config.DATA_PATH}/AGI_abs/{disease}/{date}-agi-{disease}.csv'
+
+def load_data(source, disease, date, tests=False):
     try:
-        df = pd.read_csv(path)
-        df.date = pd.to_datetime(df.date)
-        df.date = df.date.apply(lambda x: Week.fromdate(x, system='iso').enddate())
-        
-        if source in ['Survstat', 'AGI', 'AGI_abs']:
-            df.location = df.location.replace(STATE_DICT)
-            df = df.groupby(['date', 'year', 'week', 'location', 'age_group']).sum().reset_index()
-        
-        df = df.sort_values(['location', 'age_group', 'date'], ignore_index=True)
+        # use the columnar vintage store if the data version is available there
+        vintages = read_vintages(source, disease, tests, [date]) if store_available(source, disease, tests) else {}
+        df = vintages[str(date)] if str(date) in vintages else read_csv(data_path(source, disease, date, tests), 'vintage')
 
-        return df
+        return prepare_data(df, source)
 
     except:
         return None
@@ -52,15 +64,15 @@ def add_iso_dates(df):
     """
     Adds iso_week, iso_year and iso_date (end date of the week) to dataframe.
     """
-    df['iso_week'] = df.date.apply(lambda x: Week.fromdate(x, system='iso').week)
-    df['iso_year'] = df.date.apply(lambda x: Week.fromdate(x, system='iso').year)
-    df['iso_date'] = df.apply(lambda x: Week(x.iso_year, x.iso_week, system='iso'), axis=1)
+    df['iso_week'] = iso_week(df.date)
+    df['iso_year'] = iso_year(df.date)
+    df['iso_date'] = [Week(y, w, system='iso') for y, w in zip(df.iso_year, df.iso_week)]
 
     return df
 
 def list_all_files(source, disease, tests=False):
     # load all files from repo
-    path = Path(f'../data/{source}/{disease}/')
+    path = Path(f'{config.DATA_PATH}/{source}/{disease}/')
     files = [f.name for f in path.glob('*.csv') if ('test' in f.name.lower()) == tests]
      
     # create dataframe so we can easily select files by date
@@ -89,28 +101,11 @@ def get_date_range(df_files):
 
     return dates
 
-def make_placeholder(date,
-                     states=['DE-BB-BE', 'DE-BW', 'DE-BY', 'DE-HE', 'DE-MV', 'DE-NI-HB',
-                             'DE-NW', 'DE-RP-SL', 'DE-SH-HH', 'DE-SN', 'DE-ST', 'DE-TH'],
-                     age_groups=['00+', '00-04', '05-14', '15-34', '35-59', '60-79', '80+']):
-    
-    df_age_groups = pd.DataFrame({'date': date.enddate(),
-                                  'year': date.year,
-                                  'week': date.week,
-                                  'location': 'DE',
-                                  'age_group': age_groups,
-                                  'value': np.nan})
-
-    df_states = pd.DataFrame({'date': date.enddate(),
-                              'year': date.year,
-                              'week': date.week,
-                              'location': states,
-                              'age_group': '00+',
-                              'value': np.nan})
-
-    return pd.concat([df_age_groups, df_states])
-
-def make_template(source, disease, dates):
+def template_strata(source, disease):
+    """
+    Strata of the template: all age groups for Germany and all states for all ages (depending on the source).
+    Returns the lists (locations, age_groups) of the strata.
+    """
     states=['DE-BB-BE', 'DE-BW', 'DE-BY', 'DE-HE', 'DE-MV', 'DE-NI-HB',
             'DE-NW', 'DE-RP-SL', 'DE-SH-HH', 'DE-SN', 'DE-ST', 'DE-TH']
     age_groups=['00+', '00-04', '05-14', '15-34', '35-59', '60-79', '80+']
@@ -137,34 +132,93 @@ def make_template(source, disease, dates):
     elif disease == 'sari_rsv':
         age_groups = ['00+']
 
-    dfs = []
-    for date in dates:
-        df = make_placeholder(date, states, age_groups)
-        dfs.append(df)
-    df = pd.concat(dfs, ignore_index=True)
-    df = df.drop(columns=['value'])
+    return ['DE'] * len(age_groups) + states, age_groups + ['00+'] * len(states)
 
-    return df
+@lru_cache(maxsize=64)
+def _template(source, disease, dates):
+    # cartesian product of dates and strata (date-major, so the rows of the first n dates are a prefix)
+    locations, age_groups = template_strata(source, disease)
+    n = len(locations)
 
-def load_delayed_data(source, disease, date, data_version, tests=False):
-    try:
-        df = load_data(source, disease, data_version.enddate(), tests)
-    except:
-        df = None
+    return pd.DataFrame({'date': np.repeat(np.array([d.enddate() for d in dates], dtype=object), n),
+                         'year': np.repeat(np.array([d.year for d in dates], dtype='int64'), n),
+                         'week': np.repeat(np.array([d.week for d in dates], dtype='int64'), n),
+                         'location': np.tile(np.array(locations, dtype=object), len(dates)),
+                         'age_group': np.tile(np.array(age_groups, dtype=object), len(dates))})
+
+def make_template(source, disease, dates):
+    """
+    All combinations of dates and strata (columns date, year, week, location, age_group).
+    The template is built once per (source, disease, dates), callers get a copy (copy-on-write, so it is cheap).
+    """
+    return _template(source, disease, tuple(dates)).copy(deep=False)
 
-    # select relevant rows if df_temp is not None
-    if df is not None:
-        df = df[(df.date == date.enddate())]
+def template_prefix(df_template, source, disease, n_dates):
+    """
+    Rows of the first n_dates dates of a template (same as make_template for these dates), without building it again.
+    """
+    n = len(template_strata(source, disease)[0])
+    return df_template.iloc[:n_dates * n].copy(deep=False)
 
-    return df
+def load_snapshots(source, disease, data_versions, tests=False):
+    """
+    Loads every data version exactly once.
+    Returns a dictionary mapping each data version to its data with an additional column 'delay'
+    (number of weeks between data version and date).
+    Data versions in the columnar vintage store are read with a single scan, all others from csv.
+    """
+    if store_available(source, disease, tests):
+        vintages = read_vintages(source, disease, tests, [d.enddate() for d in data_versions])
+    else:
+        vintages = {}
+
+    snapshots = {}
+    for data_version in data_versions:
+        date = str(data_version.enddate())
+        try:
+            if date in vintages:
+                df = vintages[date]
+            else:
+                df = read_csv(data_path(source, disease, date, tests), 'vintage')
+                count('files_read')
+            df = prepare_data(df, source)
+        except:
+            df = None
+
+        if df is not None:
+            df['delay'] = (pd.Timestamp(data_version.enddate()) - pd.to_datetime(df.date)).dt.days // 7
+            snapshots[data_version] = df
+
+    return snapshots
 
 def load_latest_data(source, disease, tests=False):
-    df = pd.read_csv(f'../data/{source}/latest_data-{source}-{disease}{"-tests" if tests else ""}.csv')
-    df.date = pd.to_datetime(df.date)
-    df.date = df.date.apply(lambda x: Week.fromdate(x, system='iso').enddate()) 
+    df = read_csv(f'{config.DATA_PATH}/{source}/latest_data-{source}-{disease}{"-tests" if tests else ""}.csv', 'latest_data')
+    count('files_read')
+    df.date = week_enddate(df.date)
     return(df)
 
-def compute_reporting_triangle(source, disease, tests=False, max_delay=10, prospective=False):
+def triangle_path(source, disease, tests=False):
+    return (f'{config.DATA_PATH}/{source}/reporting_triangle-{"icosari" if source == "SARI" else source.lower()}'
+            f'-{disease}{"-tests" if tests else ""}.csv')
+
+def format_triangle(df, source):
+    value_cols = [c for c in df.columns if 'value' in c]
+
+    if source != "SARI_inc":
+        df[value_cols] = df[value_cols].astype('Int64')
+    else:
+        df[value_cols] = df[value_cols].round(1)
+
+    df = df[['location', 'age_group', 'year', 'week', 'date'] + value_cols]
+
+    df = df.sort_values(['location', 'age_group', 'date'], ignore_index=True)
+
+    if source in ['SARI', 'SARI_inc']:
+        df = df[(df['date'] >= pd.Timestamp('2023-10-22').date()) | (df['age_group'] == '00+')]
+
+    return df
+
+def compute_reporting_triangle(source, disease, tests=False, max_delay=10, prospective=False, export=True):
     
     # if data is reported for the ongoing week, we add an additional column for -1w
     if prospective:
@@ -173,22 +227,26 @@ def compute_reporting_triangle(source, disease, tests=False, max_delay=10, prosp
     df_files = list_all_files(source, disease, tests)
     dates = get_date_range(df_files)
 
-    df = make_template(source, disease, dates)
+    # every data version is loaded only once, the delayed values are selected from these snapshots below
+    snapshots = load_snapshots(source, disease, dates, tests)
+
+    from tqdm.auto import tqdm # progress bar only needed when computing triangles
+
+    df_template = make_template(source, disease, dates)
+    df = df_template
     for delay in tqdm(range(0, max_delay + 1), total=max_delay + 1, desc=f'{disease}{"-tests" if tests else ""}: '):
         relevant_dates = [d for d in dates if d <= max(dates) - delay]
         # if the file history is not long enough, we need to merge empty dataframes to create all columns
         if len(relevant_dates) > 0:
-            df_temp = make_template(source, disease, relevant_dates)
-            dfs = []
-            for date in relevant_dates:
-                data_version = date + delay
-                df_delayed = load_delayed_data(source, disease, date, data_version, tests)
-                dfs.append(df_delayed)
-            df_delayed = pd.concat(dfs)
+            # the dates are sorted, so the template of the relevant dates is a prefix of the full template
+            df_temp = template_prefix(df_template, source, disease, len(relevant_dates))
+            dfs = [df_snapshot[df_snapshot.delay == delay] for data_version, df_snapshot in snapshots.items()
+                   if data_version - delay >= min(relevant_dates)]
+            df_delayed = pd.concat(dfs).drop(columns='delay')
             df_temp = df_temp.merge(df_delayed, how='left')
         else:
             # create an empty template with "dates" (to create new empty columns)
-            df_temp = make_template(source, disease, dates) 
+            df_temp = df_template.copy(deep=False)
             df_temp['value'] = 'not_observed'
             
         # we flag missing values to fill later on (not all should be filled to preserve reporting triangle shape)
@@ -221,24 +279,116 @@ def compute_reporting_triangle(source, disease, tests=False, max_delay=10, prosp
     df.iloc[:, 6:] = df.iloc[:, 5:].diff(axis=1).iloc[:, 1:]
 
     # some formatting
-    value_cols = [c for c in df.columns if 'value' in c]
+    df = format_triangle(df, source)
+    set_rows(rows_in=sum(len(df_snapshot) for df_snapshot in snapshots.values()), rows_out=len(df))
 
-    if source != "SARI_inc":
-        df[value_cols] = df[value_cols].astype('Int64')
-    else:
-        df[value_cols] = df[value_cols].round(1)
+    if export:
+        write_csv(df, triangle_path(source, disease, tests), kind='triangle')
 
-    df = df[['location', 'age_group', 'year', 'week', 'date'] + value_cols]
+    return df
 
-    df = df.sort_values(['location', 'age_group', 'date'], ignore_index=True)
-    
-    path = (f'../data/{source}/reporting_triangle-{"icosari" if source == "SARI" else source.lower()}'
-            f'-{disease}{"-tests" if tests else ""}.csv')
+def update_reporting_triangle(source, disease, tests=False, max_delay=10, prospective=False, verify=False):
+    """
+    Updates an existing reporting triangle with the data versions added or changed since it was computed.
+    The hashes of the included vintage files are recorded next to the triangle (see vintage_store.included_path).
+    Only new and changed data versions (and all after them, which may carry their values forward) and the latest data
+    are loaded, the rest of the triangle is taken from the existing file.
+    Triangles of incidences (SARI_inc) are computed in full: the differences of the full computation are not
+    integers and cannot be reproduced exactly from the rounded differences in the file.
+    If verify=True, the result is compared to a full recomputation (csv text).
+    """
+    path = triangle_path(source, disease, tests)
+    df_files = list_all_files(source, disease, tests)
+    dates = get_date_range(df_files)
 
-    if source in ['SARI', 'SARI_inc']:
-        df = df[(df['date'] >= pd.Timestamp('2023-10-22').date()) | (df['age_group'] == '00+')]
-    
-    df.to_csv(path, index=False)
+    hashes = {f: file_hash(f'{config.DATA_PATH}/{source}/{disease}/{f}') for f in df_files.filename}
+    included = load_included(path)
+    full = (source == 'SARI_inc' or not os.path.exists(path) or len(included) == 0 or
+            any(f not in hashes for f in included))
+
+    if not full:
+        df = read_csv(path, 'triangle')
+        count('files_read')
+        df.date = week_enddate(df.date)
+        # files before the first week of the triangle change its rows
+        full = min(dates).enddate() != df.date.min()
+
+    if full:
+        df = compute_reporting_triangle(source, disease, tests, max_delay, prospective)
+        save_included(path, hashes)
+        return df
+
+    changed = [f for f in hashes if included.get(f) != hashes[f]]
+    if len(changed) == 0:
+        return df
+    start = min(Week.fromdate(pd.Timestamp(f[:10]), system='iso') for f in changed)
+
+    if prospective:
+        max_delay += 1
+    delay_cols = [f'value_{(delay - 1) if prospective else delay}w' for delay in range(max_delay + 1)]
+    remainder_col = f'value_>{(max_delay - 1) if prospective else max_delay}w'
+
+    # work with cumulative values per delay (not yet observed entries remain NaN)
+    new_dates = [d for d in dates if d.enddate() > df.date.max()]
+    if len(new_dates) > 0:
+        df = pd.concat([df, make_template(source, disease, new_dates)], ignore_index=True)
+    df_keys = df[['date', 'year', 'week', 'location', 'age_group']]
+    levels = df[delay_cols].astype(float).cumsum(axis=1)
+
+    # in chronological order, so values carried forward from a changed data version are updated as well
+    for data_version in [d for d in dates if d >= start]:
+        df_version = load_data(source, disease, data_version.enddate(), tests)
+
+        for delay, col in enumerate(delay_cols):
+            date = data_version - delay
+            rows = (df_keys.date == date.enddate()).to_numpy()
+            if date < min(dates) or not rows.any():
+                continue
+
+            if df_version is not None:
+                df_delayed = df_version[df_version.date == date.enddate()]
+                values = df_keys[rows].merge(df_delayed, how='left').value.astype(float).to_numpy()
+            else:
+                values = np.full(rows.sum(), np.nan)
+
+            # missing values are filled with the previous report (or zero for the initial report)
+            previous = levels.loc[rows, delay_cols[delay - 1]].to_numpy() if delay > 0 else np.zeros(rows.sum())
+            levels.loc[rows, col] = np.where(np.isnan(values), previous, values)
+
+    # remaining correction beyond the largest delay is based on the latest data
+    df_latest = load_latest_data(source, disease, tests)
+    df_latest = df_keys.merge(df_latest, how='left', indicator=True)
+    latest = np.where(df_latest['_merge'] == 'both', df_latest.value.astype(float).fillna(levels[delay_cols[-1]]), np.nan)
+
+    df[delay_cols] = levels.diff(axis=1)
+    df[delay_cols[0]] = levels[delay_cols[0]]
+    df[remainder_col] = latest - levels[delay_cols[-1]]
+
+    df = format_triangle(df, source)
+
+    if verify:
+        df_full = compute_reporting_triangle(source, disease, tests, max_delay - 1 if prospective else max_delay,
+                                             prospective, export=False)
+        check_triangles_equal(df, df_full)
+
+    set_rows(rows_out=len(df))
+    write_csv(df, path, kind='triangle')
+    save_included(path, hashes)
+
+    return df
+
+def check_triangles_equal(df, df_full):
+    """
+    Raises a ValueError if two reporting triangles would not be written to identical csv files.
+    """
+    lines = df.to_csv(index=False).splitlines()
+    lines_full = df_full.to_csv(index=False).splitlines()
+
+    if lines != lines_full:
+        # first differing line (or the end of the shorter triangle)
+        i = next((i for i, (a, b) in enumerate(zip(lines, lines_full)) if a != b), min(len(lines), len(lines_full)))
+        raise ValueError(f'Updated reporting triangle does not match the full recomputation in line {i + 1}: '
+                         f'{lines[i] if i < len(lines) else None} vs. {lines_full[i] if i < len(lines_full) else None}')
 
 
 # Compute all reporting triangles
@@ -253,15 +403,25 @@ SOURCE_DICT = {
     'AGI_abs' : ['are']
 }
 
-for source in SOURCE_DICT.keys():
-    print('___________')
-    print(source)
-    
-    for disease in SOURCE_DICT[source]:
-        if source in ['NRZ', 'CVN']:
-            compute_reporting_triangle(source, disease)
-            compute_reporting_triangle(source, disease, tests=True)
-        elif source == 'Survstat':
-            compute_reporting_triangle(source, disease, prospective=True)
-        else:
-            compute_reporting_triangle(source, disease)
+def main(incremental=False):
+    # with incremental=True only the data versions added since the last run are ingested into the existing triangles
+    compute = update_reporting_triangle if incremental else compute_reporting_triangle
+
+    jobs = []
+    for source in SOURCE_DICT.keys():
+        for disease in SOURCE_DICT[source]:
+            if source in ['NRZ', 'CVN']:
+                jobs.append((f'{source}/{disease}', (source, disease), {}))
+                jobs.append((f'{source}/{disease}-tests', (source, disease), {'tests': True}))
+            elif source == 'Survstat':
+                jobs.append((f'{source}/{disease}', (source, disease), {'prospective': True}))
+            else:
+                jobs.append((f'{source}/{disease}', (source, disease), {}))
+
+    # jobs are independent and run in parallel (number of processes can be set with WORKERS)
+    return run_jobs(compute, jobs)
+
+
+if __name__ == '__main__':
+    if len(main(incremental=os.environ.get('INCREMENTAL') == '1')) > 0:
+        raise SystemExit(1)
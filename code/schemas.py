@@ -0,0 +1,130 @@
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from vintage_store import file_hash
+
+# Column types of the csv files read by the pipeline, so pandas does not infer them for every file.
+# Strata (location, age_group) are read as categoricals (a few distinct values repeated in every row),
+# dates are kept as 'yyyy-mm-dd' strings and converted by week_functions once per distinct date.
+# Values are still inferred: integer and float vintages are written differently (e.g. 8 vs. 8.0).
+#   vintage      data files of all sources (NRZ files have no column 'year'), also the Survstat history
+#   latest_data  output of get_latest_data.py
+#   triangle     reporting triangles (all columns after 'date' are values)
+#   target       targets computed from the reporting triangles
+# With BINARY_FORMAT=parquet or feather, a binary copy is written next to the csv outputs (see write_binary).
+# read_csv reads this copy instead of parsing the csv file if it was created from the current csv file
+# (the hash of the csv file is stored in the metadata of the copy, modification times are not reliable after a checkout).
+
+STRATA = {'location': 'category', 'age_group': 'category'}
+WEEKS = {'date': str, 'year': 'int64', 'week': 'int64'}
+
+SCHEMAS = {
+    'vintage': {'columns': ['date', 'year', 'week', 'location', 'age_group', 'value'], 'dtype': {**WEEKS, **STRATA}},
+    'latest_data': {'columns': ['date', 'year', 'week', 'location', 'age_group', 'value'], 'dtype': {**WEEKS, **STRATA}},
+    'triangle': {'columns': None, 'dtype': {**WEEKS, **STRATA}},
+    'target': {'columns': None, 'dtype': {**WEEKS, **STRATA}}
+}
+
+BINARY_FORMATS = ['parquet', 'feather']
+
+
+def binary_path(path, binary_format):
+    return Path(path).with_suffix(f'.{binary_format}')
+
+
+def binary_hash(p, binary_format):
+    """
+    Hash of the csv file a binary copy was created from (None if not recorded).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(p) if binary_format == 'parquet' else pa.ipc.open_file(p).schema
+    md5 = (schema.metadata or {}).get(b'csv_md5')
+    return md5.decode() if md5 is not None else None
+
+
+def read_binary(path, kind):
+    """
+    Reads the binary copy of a csv file if there is one that is up to date (and pyarrow is available), otherwise None.
+    """
+    for binary_format in BINARY_FORMATS:
+        p = binary_path(path, binary_format)
+        if p.exists() and os.path.exists(path):
+            try:
+                if binary_hash(p, binary_format) != file_hash(path):
+                    return None
+                df = pd.read_parquet(p) if binary_format == 'parquet' else pd.read_feather(p)
+            except ImportError:
+                return None
+            columns = SCHEMAS[kind]['columns']
+            return df if columns is None else df[[c for c in df.columns if c in columns]]
+    return None
+
+
+def read_csv(path, kind, binary=True, **kwargs):
+    """
+    Reads a csv file with the schema of the given kind (see SCHEMAS), columns not in the schema are skipped.
+    With binary=True, an up-to-date binary copy is read instead if available.
+    """
+    if binary and len(kwargs) == 0:
+        df = read_binary(path, kind)
+        if df is not None:
+            return df
+
+    schema = SCHEMAS[kind]
+    if schema['columns'] is not None:
+        kwargs['usecols'] = lambda c: c in schema['columns']
+    return pd.read_csv(path, dtype=schema['dtype'], **kwargs)
+
+
+def write_binary(path, kind, binary_format=None):
+    """
+    Writes the binary copy of a csv file (format from BINARY_FORMAT if not given, nothing if not set).
+    The copy is created from the csv file as read by read_csv, so reading it returns exactly the same dataframe.
+    The hash of the csv file is stored in the metadata of the copy (see read_binary).
+    Parquet files are written with column statistics (row groups can be skipped with filters).
+    """
+    binary_format = binary_format or os.environ.get('BINARY_FORMAT')
+    if not binary_format:
+        return
+    if binary_format not in BINARY_FORMATS:
+        raise ValueError(f'Unknown binary format {binary_format}, use one of {BINARY_FORMATS}.')
+
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    df = read_csv(path, kind, binary=False)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'csv_md5': file_hash(path).encode()})
+
+    p = binary_path(path, binary_format)
+    tmp_path = p.with_name(f'.{p.name}.tmp')
+    if binary_format == 'parquet':
+        pq.write_table(table, tmp_path, write_statistics=True)
+    else:
+        feather.write_feather(table, tmp_path)
+    os.replace(tmp_path, p)
+
+    # an outdated copy in the other format would be ignored, but is removed to avoid confusion
+    for other in BINARY_FORMATS:
+        if other != binary_format and binary_path(path, other).exists():
+            os.remove(binary_path(path, other))
+
+
+def replace_values(series, mapping):
+    """
+    Series.replace(mapping) that also works for categoricals (categories may be merged, e.g. DE-BB and DE-BE).
+    Only the categories are mapped, not every row.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.replace(mapping)
+
+    categories = series.cat.categories.map(lambda c: mapping.get(c, c))
+    new_categories = categories.unique().sort_values()
+    # code -1 (missing value) stays -1
+    recode = np.append(new_categories.get_indexer(categories), -1)
+    codes = recode[series.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, new_categories), index=series.index, name=series.name)
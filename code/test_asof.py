@@ -0,0 +1,34 @@
+import shutil
+import pandas as pd
+import config
+import asof
+from reporting_triangles import load_data
+
+# asof.py against load_data for every indexed vintage.
+# Run with: python -m pytest (from ./code)
+
+
+def test_asof_vintage_matches_load_data(tmp_path, monkeypatch):
+    # NRZ influenza tests around 2022-01-02, which contains a (location, age_group, date) twice
+    source_path = config.DATA_PATH / 'NRZ' / 'influenza'
+    files = sorted(f for f in source_path.glob('*_AmountTested.csv') if '2021-11-01' <= f.name[:10] <= '2022-02-01')
+    assert '2022-01-02_AmountTested.csv' in [f.name for f in files]
+    (tmp_path / 'NRZ' / 'influenza').mkdir(parents=True)
+    for f in files:
+        shutil.copy(f, tmp_path / 'NRZ' / 'influenza' / f.name)
+    monkeypatch.setattr(config, 'DATA_PATH', tmp_path)
+
+    asof.build_index('NRZ', 'influenza', tests=True)
+    index = asof.load_index('NRZ', 'influenza', tests=True)
+
+    for f in files:
+        data_version = f.name[:10]
+        expected = load_data('NRZ', 'influenza', data_version, tests=True)
+        expected = expected.drop_duplicates(subset=['location', 'age_group', 'date'], keep='first')
+        expected = expected.sort_values(['location', 'age_group', 'date'], ignore_index=True)
+        expected = expected.astype({'location': str, 'age_group': str})
+        result = asof.asof_vintage(index, data_version)
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+    # the first of the repeated rows is kept, as in get_latest_data.combine_file_history
+    assert asof.asof_value(index, 'DE', '00+', '2022-01-09', '2022-01-02') == 40
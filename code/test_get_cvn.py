@@ -0,0 +1,109 @@
+import io
+import threading
+import filecmp
+import numpy as np
+import pandas as pd
+import pytest
+import pyzipper
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+import get_cvn
+
+# get_cvn.py against a local HTTP stand-in of the CVN server serving AES-encrypted daily archives.
+# Run with: python -m pytest (from ./code)
+
+PASSWORD = 'secret'
+
+
+def make_archive(seed, n=200):
+    # daily extract with random test results (1 = negative, 2 = positive, 3 = not tested)
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'respId': rng.integers(0, 50, n).astype(str),
+                       'patId': rng.integers(0, 100, n).astype(str),
+                       'dt': rng.integers(0, 10, n),
+                       'date': (pd.Timestamp.today().normalize() - pd.to_timedelta(rng.integers(0, 30, n), unit='D')).strftime('%Y-%m-%d'),
+                       'infasaisonpos': rng.integers(1, 4, n),
+                       'rsvpos': rng.integers(1, 4, n),
+                       'bakstrepos': rng.integers(1, 4, n)})
+    buffer = io.BytesIO()
+    with pyzipper.AESZipFile(buffer, 'w', compression=pyzipper.ZIP_DEFLATED, encryption=pyzipper.WZ_AES) as f:
+        f.setpassword(PASSWORD.encode('utf-8'))
+        f.writestr('respAll_filtered.csv', df.to_csv(index=False))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def server():
+    archives = {}
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.respond(body=False)
+
+        def do_GET(self):
+            self.respond(body=True)
+
+        def respond(self, body):
+            name = self.path.lstrip('/')
+            requests.append((self.command, name))
+            if name not in archives:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(archives[name])))
+            self.end_headers()
+            if body:
+                self.wfile.write(archives[name])
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/', archives, requests
+    httpd.shutdown()
+
+
+def run(tmp_path, name, url, monkeypatch, first_date):
+    """
+    Runs get_cvn.main with the data directory and cache 'name' in tmp_path (created on the first run).
+    """
+    data_path = tmp_path / name / 'data'
+    daily_path = data_path / 'CVN' / 'daily_resolution' / 'influenza'
+    if not daily_path.exists():
+        # the archives before first_date were processed before
+        daily_path.mkdir(parents=True)
+        (daily_path / f'{first_date}-cvn-influenza.csv').write_text('')
+    monkeypatch.setattr(config, 'DATA_PATH', data_path)
+    monkeypatch.setenv('CVN_CACHE', str(tmp_path / name / 'cache'))
+    monkeypatch.setenv('CVN_URL', url)
+    monkeypatch.setenv('CVN_USER', 'user')
+    monkeypatch.setenv('CVN_PASSWORD', PASSWORD)
+    get_cvn.main()
+    return data_path / 'CVN'
+
+
+def test_incremental_run(server, tmp_path, monkeypatch):
+    url, archives, requests = server
+    dates = [str((pd.Timestamp.today() - pd.Timedelta(days=d)).date()) for d in range(6, -1, -1)]
+    for i, date in enumerate(dates[:-1]):
+        archives[f'filtered_{date}.zip'] = make_archive(i)
+
+    run(tmp_path, 'incremental', url, monkeypatch, dates[0])
+
+    # a second run with one new archive only downloads this archive
+    archives[f'filtered_{dates[-1]}.zip'] = make_archive(len(dates))
+    requests.clear()
+    incremental = run(tmp_path, 'incremental', url, monkeypatch, dates[0])
+    assert [r for r in requests if r[0] == 'GET'] == [('GET', f'filtered_{dates[-1]}.zip')]
+
+    # the outputs are the same as when all archives are processed without cache
+    full = run(tmp_path, 'full', url, monkeypatch, dates[0])
+    files = sorted(f.relative_to(full) for f in full.rglob('*.csv') if 'vintages' not in str(f))
+    assert len(files) > 0
+    assert files == sorted(f.relative_to(incremental) for f in incremental.rglob('*.csv') if 'vintages' not in str(f))
+    for f in files:
+        assert filecmp.cmp(full / f, incremental / f, shallow=False), f
@@ -0,0 +1,43 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import count, pop_records, stage
+
+# Counters of stages running in several threads.
+# Run with: python -m pytest (from ./code)
+
+
+def test_concurrent_stages():
+    pop_records()
+    barrier = threading.Barrier(4)
+
+    def ingest(n):
+        with stage('ingest_file', n=n):
+            # all stages are open before any of them counts
+            barrier.wait()
+            count('http_requests', n)
+            count('files_written')
+            barrier.wait()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(ingest, range(1, 5)))
+
+    records = sorted(pop_records(), key=lambda r: r['n'])
+    assert [r['http_requests'] for r in records] == [1, 2, 3, 4]
+    assert [r['files_written'] for r in records] == [1, 1, 1, 1]
+    # CPU time and bytes are only known for the whole process
+    assert all(r['cpu_seconds'] is None and r.get('bytes_read') is None for r in records)
+
+
+def test_worker_threads():
+    pop_records()
+    with stage('resolve_commits'):
+        with stage('lookup'):
+            count('cache_hits')
+        # threads without stages count for the stage that started them
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: count('http_requests'), range(8)))
+
+    lookup, resolve = pop_records()
+    assert (lookup['cache_hits'], lookup['http_requests']) == (1, 0)
+    assert (resolve['cache_hits'], resolve['http_requests']) == (1, 8)
+    assert resolve['cpu_seconds'] is not None
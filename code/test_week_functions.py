@@ -0,0 +1,42 @@
+import datetime
+import numpy as np
+import pandas as pd
+from epiweeks import Week
+from week_functions import iso_enddate, iso_week, iso_year, week_enddate
+
+# The vectorized helpers are compared with epiweeks for every day between 2000 and 2040.
+# Run with: python -m pytest (from ./code)
+
+DATES = pd.Series(pd.date_range('2000-01-01', '2040-12-31').date)
+WEEKS = [Week.fromdate(d, system='iso') for d in DATES]
+
+
+def test_iso_week():
+    assert iso_week(DATES).tolist() == [w.week for w in WEEKS]
+
+
+def test_iso_year():
+    assert iso_year(DATES).tolist() == [w.year for w in WEEKS]
+
+
+def test_week_enddate():
+    assert week_enddate(DATES).tolist() == [w.enddate() for w in WEEKS]
+
+
+def test_week_enddate_strings():
+    assert week_enddate(DATES.astype(str)).tolist() == [w.enddate() for w in WEEKS]
+
+
+def test_iso_enddate():
+    weeks = sorted(set((w.year, w.week) for w in WEEKS))
+    years, numbers = zip(*weeks)
+    assert iso_enddate(list(years), list(numbers)).tolist() == [Week(y, n, system='iso').enddate() for y, n in weeks]
+
+
+def test_missing_dates():
+    dates = pd.Series(['2024-01-03', None, '2024-05-05'])
+    enddates = week_enddate(dates)
+    assert enddates[0] == datetime.date(2024, 1, 7)
+    assert pd.isna(enddates[1])
+    assert enddates[2] == datetime.date(2024, 5, 5)
+    assert np.isnan(iso_week(dates)[1]) and iso_week(dates)[2] == 18
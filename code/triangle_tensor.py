@@ -0,0 +1,127 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from job_runner import run_jobs
+import config
+
+# Dense representation of a reporting triangle as a tensor of shape (location x age_group x date x delay).
+# Stored next to the csv file as
+#   <name>.npy       values (NaN if not observed)
+#   <name>-mask.npy  True for all (location, age_group, date) rows contained in the triangle
+#   <name>.json      axis labels and dtype information
+# Both arrays are opened memory-mapped, so selecting a stratum (contiguous block) or a delay only reads the required parts.
+
+def tensor_paths(path):
+    path = Path(path)
+    return path.with_suffix('.npy'), path.with_name(path.stem + '-mask.npy'), path.with_suffix('.json')
+
+
+def triangle_to_tensor(df):
+    """
+    Converts a reporting triangle (as written to csv) to (values, mask, metadata).
+    """
+    value_cols = [c for c in df.columns if 'value' in c]
+    values = df[value_cols].astype('float64').to_numpy()
+
+    # counts are stored as float32 as long as they are represented exactly
+    integer = bool(np.all(np.isnan(values) | (values == np.round(values))))
+    dtype = 'float32' if integer and np.nanmax(np.abs(values), initial=0) < 2**24 else 'float64'
+
+    location_codes, locations = pd.factorize(df.location, sort=True)
+    age_group_codes, age_groups = pd.factorize(df.age_group, sort=True)
+    date_codes, dates = pd.factorize(df.date.astype(str), sort=True)
+
+    weeks = df.groupby(df.date.astype(str))[['year', 'week']].first().loc[dates]
+
+    data = np.full((len(locations), len(age_groups), len(dates), len(value_cols)), np.nan, dtype=dtype)
+    data[location_codes, age_group_codes, date_codes] = values
+    mask = np.zeros(data.shape[:3], dtype=bool)
+    mask[location_codes, age_group_codes, date_codes] = True
+
+    metadata = {'location': list(locations),
+                'age_group': list(age_groups),
+                'date': list(dates),
+                'year': weeks.year.astype(int).tolist(),
+                'week': weeks.week.astype(int).tolist(),
+                'delay': value_cols,
+                'integer': integer}
+
+    return data, mask, metadata
+
+
+def write_tensor(df, path):
+    """
+    Writes the tensor representation of the triangle df (path of the csv file or without suffix).
+    """
+    data, mask, metadata = triangle_to_tensor(df)
+    data_path, mask_path, metadata_path = tensor_paths(path)
+
+    for p, content in [(data_path, data), (mask_path, mask)]:
+        tmp_path = p.with_name(f'.{p.name}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, content)
+        tmp_path.replace(p)
+
+    metadata_path.write_text(json.dumps(metadata, indent=1))
+
+
+def load_tensor(path, mmap_mode='r'):
+    """
+    Opens the tensor representation of a triangle (memory-mapped by default).
+    Returns (values, mask, metadata).
+    """
+    data_path, mask_path, metadata_path = tensor_paths(path)
+    metadata = json.loads(metadata_path.read_text())
+    return np.load(data_path, mmap_mode=mmap_mode), np.load(mask_path, mmap_mode=mmap_mode), metadata
+
+
+def stratum_view(data, metadata, location, age_group):
+    """
+    Zero-copy view of shape (date x delay) for a single stratum.
+    """
+    return data[metadata['location'].index(location), metadata['age_group'].index(age_group)]
+
+
+def delay_view(data, metadata, delay):
+    """
+    Zero-copy view of shape (location x age_group x date) for a single delay (column name, e.g. 'value_0w').
+    """
+    return data[..., metadata['delay'].index(delay)]
+
+
+def tensor_to_triangle(data, mask, metadata):
+    """
+    Converts the tensor back to the csv representation (rows sorted by location, age_group and date).
+    """
+    location_codes, age_group_codes, date_codes = np.nonzero(mask)
+
+    df = pd.DataFrame({'location': np.array(metadata['location'], dtype=object)[location_codes],
+                       'age_group': np.array(metadata['age_group'], dtype=object)[age_group_codes],
+                       'year': np.array(metadata['year'])[date_codes],
+                       'week': np.array(metadata['week'])[date_codes],
+                       'date': np.array(metadata['date'], dtype=object)[date_codes]})
+
+    values = pd.DataFrame(np.asarray(data[location_codes, age_group_codes, date_codes], dtype='float64'),
+                          columns=metadata['delay'])
+    if metadata['integer']:
+        values = values.astype('Int64')
+
+    return pd.concat([df, values], axis=1)
+
+
+def process_file(f):
+    # parse floats exactly as written (the default parser may differ in the last digit)
+    write_tensor(pd.read_csv(f, float_precision='round_trip'), f)
+
+
+def main():
+    path = config.DATA_PATH
+    files = [f for f in path.rglob('*reporting_triangle*.csv')]
+
+    return run_jobs(process_file, [(str(f), (f,), {}) for f in files])
+
+
+if __name__ == '__main__':
+    if len(main()) > 0:
+        raise SystemExit(1)
@@ -0,0 +1,26 @@
+from vintage_store import update_store
+
+SOURCE_DICT = {
+    'SARI' : ['sari', 'sari_covid19', 'sari_influenza', 'sari_rsv'],
+    'SARI_inc' : ['sari', 'sari_covid19', 'sari_influenza', 'sari_rsv'],
+    'NRZ' : ['influenza', 'rsv'],
+    'Survstat' : ['influenza', 'rsv', 'pneumococcal', 'covid19'],
+    'CVN' : ['influenza', 'rsv', 'pneumococcal'],
+    'AGI' : ['are'],
+    'AGI_abs' : ['are']
+}
+
+# Add new or changed csv files of all sources to the columnar vintage store
+def main():
+    for source in SOURCE_DICT.keys():
+        print('___________')
+        print(source)
+
+        for disease in SOURCE_DICT[source]:
+            print(f'{disease}: {update_store(source, disease)} new vintages')
+            if source in ['NRZ', 'CVN']:
+                print(f'{disease}-tests: {update_store(source, disease, tests=True)} new vintages')
+
+
+if __name__ == '__main__':
+    main()
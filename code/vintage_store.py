@@ -0,0 +1,215 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from instrumentation import count
+import config
+
+# All vintages of a (source, disease, tests) combination are stored as one parquet dataset
+# partitioned by data_version, e.g. ../data/NRZ/influenza/vintages/data_version=2025-01-05/part-0.parquet.
+# The manifest (_manifest.csv) lists every stored vintage together with the hash of the csv file it was created from.
+# The store is not part of the repository (see .gitignore), the workflows keep it in the actions cache. It can always
+# be rebuilt from the csv files with update_vintage_store.py.
+# Outputs updated incrementally record the vintage files they include (with hashes) in <output>-vintages.txt.
+
+COLUMNS = ['date', 'year', 'week', 'location', 'age_group', 'value']
+MANIFEST_COLUMNS = ['data_version', 'filename', 'md5', 'rows', 'columns', 'value_dtype']
+
+
+def store_path(source, disease, tests=False):
+    return Path(f'{config.DATA_PATH}/{source}/{disease}/vintages{"-tests" if tests else ""}/')
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([('date', pa.string()),
+                      ('year', pa.int64()),
+                      ('week', pa.int64()),
+                      ('location', pa.string()),
+                      ('age_group', pa.string()),
+                      ('value', pa.float64())])
+
+
+def list_vintage_files(source, disease, tests=False):
+    path = Path(f'{config.DATA_PATH}/{source}/{disease}/')
+    return sorted(f for f in path.glob('*.csv') if ('test' in f.name.lower()) == tests)
+
+
+def file_hash(path):
+    return hashlib.md5(Path(path).read_bytes()).hexdigest()
+
+
+def included_path(path):
+    """
+    File listing the vintage files (and their hashes) included in an output, used by the incremental updates.
+    """
+    return Path(str(path).replace('.csv', '-vintages.txt'))
+
+
+def load_included(path):
+    """
+    Dictionary mapping the names of the vintage files included in an output to their hashes (empty if not recorded).
+    """
+    p = included_path(path)
+    if not p.exists():
+        return {}
+    return dict(line.split(' ') for line in p.read_text().splitlines() if line != '')
+
+
+def save_included(path, hashes):
+    p = included_path(path)
+    tmp_path = p.with_name(f'.{p.name}.tmp')
+    tmp_path.write_text(''.join(f'{name} {md5}\n' for name, md5 in sorted(hashes.items())))
+    os.replace(tmp_path, p)
+
+
+def load_manifest(source, disease, tests=False):
+    path = store_path(source, disease, tests) / '_manifest.csv'
+    if not path.exists():
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return pd.read_csv(path, dtype={'data_version': str, 'filename': str, 'md5': str})
+
+
+def store_available(source, disease, tests=False):
+    """
+    True if a manifest exists and pyarrow can be imported.
+    """
+    try:
+        import pyarrow.dataset
+    except ImportError:
+        return False
+    return (store_path(source, disease, tests) / '_manifest.csv').exists()
+
+
+def current_entries(manifest, source, disease, tests=False):
+    """
+    Manifest entries whose csv file has not changed since it was stored (or was removed since).
+    Vintages whose csv file was rewritten after the last update_store are read from csv until the store is updated.
+    """
+    path = Path(f'{config.DATA_PATH}/{source}/{disease}/')
+    current = [not (path / f).exists() or file_hash(path / f) == md5 for f, md5 in zip(manifest.filename, manifest.md5)]
+    return manifest[current]
+
+
+def write_manifest(df, source, disease, tests=False):
+    path = store_path(source, disease, tests) / '_manifest.csv'
+    df.to_csv(path.with_suffix('.tmp'), index=False)
+    os.replace(path.with_suffix('.tmp'), path)
+
+
+def write_vintage(df, source, disease, data_version, tests=False):
+    """
+    Writes (or replaces) the partition of a single data version.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = store_path(source, disease, tests) / f'data_version={data_version}'
+    os.makedirs(path, exist_ok=True)
+
+    df = df.reindex(columns=COLUMNS)
+    df['date'] = df['date'].astype(str)
+    table = pa.Table.from_pandas(df, schema=_schema(), preserve_index=False)
+    # files starting with '.' or '_' are ignored when reading the dataset
+    pq.write_table(table, path / '.part-0.parquet.tmp')
+    os.replace(path / '.part-0.parquet.tmp', path / 'part-0.parquet')
+
+
+def update_store(source, disease, tests=False):
+    """
+    Adds all csv vintages that are new or have changed since the last update to the store.
+    """
+    manifest = load_manifest(source, disease, tests)
+    stored_hashes = dict(zip(manifest.filename, manifest.md5))
+
+    new_entries = []
+    for f in list_vintage_files(source, disease, tests):
+        md5 = file_hash(f)
+        if stored_hashes.get(f.name) == md5:
+            continue
+
+        df = pd.read_csv(f)
+        count('files_read')
+        data_version = f.name[:10]
+        write_vintage(df, source, disease, data_version, tests)
+        new_entries.append({'data_version': data_version,
+                            'filename': f.name,
+                            'md5': md5,
+                            'rows': len(df),
+                            'columns': ' '.join(df.columns),
+                            'value_dtype': str(df.value.dtype) if len(df) > 0 else 'object'})
+
+    if len(new_entries) > 0:
+        manifest = pd.concat([manifest, pd.DataFrame(new_entries)])
+        manifest = manifest.drop_duplicates(subset='filename', keep='last')
+        manifest = manifest.sort_values('data_version', ignore_index=True)
+        write_manifest(manifest, source, disease, tests)
+
+    return len(new_entries)
+
+
+def read_store(source, disease, tests=False, data_versions=None, columns=None, filter=None):
+    """
+    Reads the stored vintages with a single scan of the parquet dataset.
+    Returns one long dataframe with an additional column 'data_version'.
+    Only the requested columns and data versions (and rows matching the optional pyarrow filter) are read.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([('data_version', pa.string())]), flavor='hive')
+    dataset = ds.dataset(store_path(source, disease, tests), format='parquet', partitioning=partitioning)
+
+    if data_versions is not None:
+        version_filter = ds.field('data_version').isin([str(v) for v in data_versions])
+        filter = version_filter if filter is None else filter & version_filter
+
+    if columns is not None:
+        columns = ['data_version'] + [c for c in columns if c != 'data_version']
+
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+def read_vintages(source, disease, tests=False, data_versions=None, columns=None):
+    """
+    Reads the stored vintages with a single scan and splits them by data version.
+    Returns a dictionary mapping data versions ('yyyy-mm-dd') to dataframes that match what
+    pd.read_csv would return for the original csv files (columns and dtype of 'value').
+    Vintages whose csv file changed since they were stored are not returned (see current_entries).
+    """
+    manifest = load_manifest(source, disease, tests)
+    if data_versions is not None:
+        manifest = manifest[manifest.data_version.isin([str(v) for v in data_versions])]
+    manifest = current_entries(manifest, source, disease, tests)
+    if len(manifest) == 0:
+        return {}
+
+    df = read_store(source, disease, tests, manifest.data_version, columns)
+    count('files_read', len(manifest))
+    for c in ['year', 'week']:
+        if c in df.columns and df[c].notna().all():
+            df[c] = df[c].astype('int64')
+
+    # rows of each data version are contiguous after sorting, so they can be selected with cheap slices
+    df = df.sort_values('data_version', kind='stable', ignore_index=True)
+    versions = df.data_version.to_numpy()
+
+    column_selections = {}
+    vintages = {}
+    for row in manifest.itertuples():
+        cols = [c for c in row.columns.split(' ') if columns is None or c in columns]
+        if row.columns not in column_selections:
+            column_selections[row.columns] = df[cols]
+
+        start, end = np.searchsorted(versions, row.data_version, side='left'), np.searchsorted(versions, row.data_version, side='right')
+        if end > start:
+            df_vintage = column_selections[row.columns].iloc[start:end].reset_index(drop=True)
+            if 'value' in cols and row.value_dtype != 'float64':
+                df_vintage['value'] = df_vintage['value'].astype(row.value_dtype)
+            vintages[row.data_version] = df_vintage
+        else:
+            vintages[row.data_version] = pd.DataFrame(columns=cols)
+
+    return vintages
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+
+def _weekday(days):
+    """
+    Weekday of datetime64[D] values (Monday = 0, ..., Sunday = 6).
+    """
+    return (days.astype(np.int64) + 3) % 7
+
+
+def _map_unique(dates, func):
+    """
+    Applies func only to the distinct dates and maps the results back to all rows.
+    Data files contain only a few hundred distinct dates but many rows per date, so dates given as strings
+    are also parsed only once. Missing dates (code -1) give missing results.
+    """
+    dates = pd.Series(dates)
+    codes, uniques = pd.factorize(dates)
+    result = func(pd.to_datetime(uniques).to_numpy().astype('datetime64[D]'))
+    return pd.Series(pd.api.extensions.take(np.asarray(result), codes, allow_fill=True), index=dates.index)
+
+
+def iso_week(dates):
+    """
+    ISO week of the given dates.
+    """
+    def func(days):
+        thursday = days + (3 - _weekday(days))
+        return (thursday - thursday.astype('datetime64[Y]')).astype(np.int64) // 7 + 1
+
+    return _map_unique(dates, func)
+
+
+def iso_year(dates):
+    """
+    ISO year of the given dates.
+    """
+    def func(days):
+        thursday = days + (3 - _weekday(days))
+        return thursday.astype('datetime64[Y]').astype(np.int64) + 1970
+
+    return _map_unique(dates, func)
+
+
+def week_enddate(dates):
+    """
+    End date (Sunday) of the ISO week containing the given dates.
+    Equivalent to dates.apply(lambda x: Week.fromdate(x, system='iso').enddate()).
+    """
+    def func(days):
+        return (days + (6 - _weekday(days))).astype(object)
+
+    return _map_unique(dates, func)
+
+
+def iso_enddate(years, weeks):
+    """
+    End date (Sunday) of the given ISO years and weeks.
+    Equivalent to Week(year, week, system='iso').enddate() for each row.
+    """
+    years = pd.Series(years)
+    weeks = np.asarray(weeks, dtype=np.int64)
+
+    # the first ISO week of a year is the week containing January 4th
+    jan4 = (years.to_numpy(dtype=np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[D]') + 3
+    first_sunday = jan4 + (6 - _weekday(jan4))
+    days = first_sunday + 7 * (weeks - 1)
+
+    return pd.Series(days.astype(object), index=years.index)